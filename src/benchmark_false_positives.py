@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark of false positive detection against the per-SNV scan it replaced."""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import filter
+from sample import Sample, compute_vaf
+
+
+def make_samples(n_samples, n_snv, seed=0):
+    """Make samples with random SNVs drawn from a shared pool.
+
+    Args:
+        n_samples: number of samples
+        n_snv: number of SNVs per sample
+        seed: random seed
+
+    Returns:
+            sample instances
+
+    """
+    rng = np.random.default_rng(seed)
+    pool = pd.Series(['1:' + str(pos) + ':A:C' for pos in rng.choice(10**8, size=2 * n_snv, replace=False)])
+    samples = []
+    for i in range(n_samples):
+        snv = pd.DataFrame({'SNV': pool.sample(n_snv, random_state=int(rng.integers(2**31))).to_numpy()})
+        depth = rng.integers(10, 200, size=n_snv)
+        snv['FILTER'] = rng.choice(['PASS', 'REJECT'], size=n_snv)
+        snv['t_depth'] = depth.astype(str)
+        snv['t_alt_count'] = rng.integers(0, depth // 2 + 1).astype(str)
+        snv.name = 'sample_' + str(i)
+        samples.append(Sample(snv))
+    return samples
+
+
+def get_false_positives_scan(samples, union, vaf_th):
+    """Reference implementation scanning every sample for every SNV in the union.
+
+    Args:
+        samples: list of sample instances.
+        union: union of SNVs
+        vaf_th: vaf threshold.
+
+    Returns:
+        false positives
+
+    """
+    for sample in samples:
+        snv_list = sample.get_snv_list().assign(VAF=compute_vaf(sample.get_snv_list()))
+        flags = []
+        for snv in union['SNV']:
+            rows = snv_list[snv_list['SNV'] == snv]
+            flags.append(len(rows) > 0 and filter.is_rejected_with_high_vaf(rows['VAF'].iloc[0], rows['FILTER'].iloc[0], vaf_th))
+        union[sample.get_name()] = flags
+
+    false_positives = pd.concat([union[union[sample.get_name()]] for sample in samples])
+    return false_positives.drop_duplicates(subset='SNV', keep='first', inplace=False)
+
+
+def main():
+    """Time both implementations for growing cohorts and check that they agree."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', nargs='+', type=int, default=[2, 5, 10, 20], help='cohort sizes to time')
+    parser.add_argument('--snv', nargs='+', type=int, default=[500, 1000, 2000], help='SNVs per sample to time')
+    parser.add_argument('--skip_scan', action='store_true', help='only time the indexed implementation')
+    args = parser.parse_args()
+
+    print('samples\tsnv\tunion\tindexed_s\tscan_s')
+    for n_snv in args.snv:
+        for n_samples in args.samples:
+            samples = make_samples(n_samples, n_snv)
+            union = pd.concat([s.get_snv_list()[['SNV']] for s in samples]).drop_duplicates().reset_index(drop=True)
+            union['SYMBOL'] = 'GENE'
+
+            start = time.perf_counter()
+            indexed = filter.get_false_positives(samples, union[['SNV', 'SYMBOL']].copy(), 5)
+            indexed_time = time.perf_counter() - start
+
+            scan_time = float('nan')
+            if not args.skip_scan:
+                start = time.perf_counter()
+                scan = get_false_positives_scan(samples, union[['SNV', 'SYMBOL']].copy(), 5)
+                scan_time = time.perf_counter() - start
+                pd.testing.assert_frame_equal(indexed, scan)
+
+            print('\t'.join([str(n_samples), str(n_snv), str(len(union)), '%.3f' % indexed_time, '%.3f' % scan_time]))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,66 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Build PyClone input files from samtools results and TitanCNA segments."""
+
 import pandas as pd
 import numpy as np
 import argparse
-import os
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument('sample_name',help = 'sample name')
-parser.add_argument('union_symbols',type = argparse.FileType('r'),help = 'path to list of SNVs in tsv format annotated with gene symbols')
-parser.add_argument('samtools_snv',type = argparse.FileType('r'),help = 'path to output file from convert_pileup.py in tsv format')
-parser.add_argument('titan_file',type = argparse.FileType('r'),help='path to segs.txt output file from TitanCNA')
-args = parser.parse_args()
+def normalize_chromosome(chromosomes):
+    """Chromosome names as strings without 'chr' prefix.
+
+    Args:
+        chromosomes: pandas Series of chromosome names or numbers
+
+    Returns:
+           pandas Series of chromosome names
+
+    """
+    return chromosomes.astype(str).str.replace('^chr', '', regex=True)
+
+
+def index_segments(titan_file):
+    """Index TitanCNA segments per chromosome, sorted by start position.
+
+    Args:
+        titan_file: pandas DataFrame from TitanCNA segs.txt
+
+    Returns:
+           dictionary from chromosome to (starts, ends, major, minor) numpy arrays
+
+    """
+    segments = titan_file.assign(Chromosome=normalize_chromosome(titan_file['Chromosome']))
+    segments = segments.sort_values(['Chromosome', 'Start_Position.bp.'], kind='mergesort')
+
+    index = {}
+    for chrom, segs in segments.groupby('Chromosome', sort=False):
+        index[chrom] = (segs['Start_Position.bp.'].to_numpy(), segs['End_Position.bp.'].to_numpy(),
+                        segs['MajorCN'].to_numpy(), segs['MinorCN'].to_numpy())
+
+    return index
+
+
+def annotate_copy_number(pyclonefile, segment_index):
+    """Set major_cn and minor_cn of mutations inside a segment, other mutations keep their defaults.
+
+    A mutation is inside a segment if start <= pos <= end, found with one searchsorted per chromosome.
 
+    Args:
+        pyclonefile: pandas DataFrame with chrom, pos, major_cn and minor_cn columns
+        segment_index: segment index from index_segments
 
+    Returns:
+           pyclonefile
 
-name = args.sample_name
-union = pd.read_csv(args.union_symbols,sep='\t',names = ['SNV','SYMBOL'])
-samtools_snv = pd.read_csv(args.samtools_snv.name, sep ='\t')
-titan_file = pd.read_csv(args.titan_file.name,sep ='\t')
+    """
+    major_cn = pyclonefile['major_cn'].to_numpy().copy()
+    minor_cn = pyclonefile['minor_cn'].to_numpy().copy()
+    chrom = pyclonefile['chrom'].to_numpy()
+    pos = pyclonefile['pos'].to_numpy()
 
+    for name, (starts, ends, major, minor) in segment_index.items():
+        rows = np.flatnonzero(chrom == name)
+        segment = np.searchsorted(starts, pos[rows], side='right') - 1
+        inside = (segment >= 0) & (pos[rows] <= ends[np.maximum(segment, 0)])
+        major_cn[rows[inside]] = major[segment[inside]]
+        minor_cn[rows[inside]] = minor[segment[inside]]
 
+    pyclonefile['major_cn'] = major_cn
+    pyclonefile['minor_cn'] = minor_cn
+    return pyclonefile
 
 
-pyclonefile = samtools_snv.merge(union, on=['SNV'])
+def build_pyclone_frame(samtools_snv, union, segment_index):
+    """Build PyClone input for one sample.
 
+    Args:
+        samtools_snv: pandas DataFrame from <name>_samtools_result.tsv of convert_pileup.py
+        union: pandas DataFrame with SNV and SYMBOL columns
+        segment_index: segment index from index_segments
 
+    Returns:
+           pandas DataFrame in PyClone tsv format
 
-pyclonefile['mutation_id'] = pyclonefile['SYMBOL']+ ':' + pyclonefile['SNV'].str.split(':').str[0] +':'+ pyclonefile['SNV'].str.split(':').str[1]
-pyclonefile = pyclonefile[['mutation_id','DP','ALT_COUNT','VAF']]
-pyclonefile.columns = ['mutation_id','DP','var_counts','variant_freq']
+    """
+    pyclonefile = samtools_snv.merge(union, on=['SNV'])
 
-pyclonefile['ref_counts'] = pyclonefile['DP'] - pyclonefile['var_counts']
-pyclonefile = pyclonefile[['mutation_id','ref_counts','var_counts','variant_freq']]
-pyclonefile['variant_freq'] = pyclonefile['variant_freq'] / 100
+    pyclonefile['mutation_id'] = pyclonefile['SYMBOL'] + ':' + pyclonefile['SNV'].str.split(':').str[0] + ':' + pyclonefile['SNV'].str.split(':').str[1]
+    pyclonefile = pyclonefile[['mutation_id', 'DP', 'ALT_COUNT', 'VAF']]
+    pyclonefile.columns = ['mutation_id', 'DP', 'var_counts', 'variant_freq']
 
-pyclonefile['chrom'] = pyclonefile['mutation_id'].str.split(':').str[1]
-pyclonefile['pos'] = pyclonefile['mutation_id'].str.split(':').str[2]
-pyclonefile['normal_cn'] = 2
-pyclonefile['minor_cn'] = 1
-pyclonefile['major_cn'] = 1
+    pyclonefile = pyclonefile.assign(ref_counts=pyclonefile['DP'] - pyclonefile['var_counts'])
+    pyclonefile = pyclonefile[['mutation_id', 'ref_counts', 'var_counts', 'variant_freq']]
+    pyclonefile = pyclonefile.assign(variant_freq=pyclonefile['variant_freq'] / 100)
 
+    pyclonefile['chrom'] = normalize_chromosome(pyclonefile['mutation_id'].str.split(':').str[1])
+    pyclonefile['pos'] = pd.to_numeric(pyclonefile['mutation_id'].str.split(':').str[2])
+    pyclonefile['normal_cn'] = 2
+    pyclonefile['minor_cn'] = 1
+    pyclonefile['major_cn'] = 1
 
-pyclonefile.loc[pyclonefile['chrom'] == 'X','normal_cn'] = 1
-pyclonefile.loc[pyclonefile['chrom'] == 'X','minor_cn'] = 0
-pyclonefile['pos'] = pd.to_numeric(pyclonefile['pos'])
+    pyclonefile.loc[pyclonefile['chrom'] == 'X', 'normal_cn'] = 1
+    pyclonefile.loc[pyclonefile['chrom'] == 'X', 'minor_cn'] = 0
 
+    pyclonefile = annotate_copy_number(pyclonefile, segment_index)
 
+    return pyclonefile[['mutation_id', 'ref_counts', 'var_counts', 'normal_cn', 'minor_cn', 'major_cn', 'variant_freq']]
 
-for chrom in range(1,22):
-    titan_sub = titan_file[titan_file['Chromosome'] == chrom ]
-    pyclone_sub = pyclonefile[pyclonefile['chrom'] == str(chrom)]
-    start = titan_sub['Start_Position.bp.'].tolist()
-    stop = titan_sub['End_Position.bp.'].tolist()
-    major = titan_sub['MajorCN'].tolist()
-    minor = titan_sub['MinorCN'].tolist()
-    criteria = [pyclone_sub['pos'].between(i,j) for i , j in zip(start,stop)]
 
+def main():
+    """Write <sample_name>_pyclone.tsv."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sample_name', help='sample name')
+    parser.add_argument('union_symbols', type=argparse.FileType('r'), help='path to list of SNVs in tsv format annotated with gene symbols')
+    parser.add_argument('samtools_snv', type=argparse.FileType('r'), help='path to output file from convert_pileup.py in tsv format')
+    parser.add_argument('titan_file', type=argparse.FileType('r'), help='path to segs.txt output file from TitanCNA')
+    args = parser.parse_args()
 
-    pyclonefile.loc[:,'major_cn'][pyclonefile['chrom'] == str(chrom)] = np.select(criteria, major, 1)
-    pyclonefile.loc[:,'minor_cn'][pyclonefile['chrom'] == str(chrom)] = np.select(criteria, minor,1)
+    name = args.sample_name
+    union = pd.read_csv(args.union_symbols, sep='\t', names=['SNV', 'SYMBOL'])
+    samtools_snv = pd.read_csv(args.samtools_snv.name, sep='\t')
+    titan_file = pd.read_csv(args.titan_file.name, sep='\t')
 
+    pyclonefile = build_pyclone_frame(samtools_snv, union, index_segments(titan_file))
 
+    pyclonefile.to_csv(name + '_pyclone.tsv', sep='\t')
 
-pyclonefile = pyclonefile[['mutation_id','ref_counts','var_counts','normal_cn', 'minor_cn','major_cn','variant_freq']]
 
-pyclonefile.to_csv(name + '_pyclone.tsv',sep='\t')
+if __name__ == '__main__':
+    main()
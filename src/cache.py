@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Cache of parsed sample frames keyed by fingerprints of the input files."""
+
+import hashlib
+import os
+import pandas as pd
+
+try:
+    import pyarrow.feather  # noqa: F401
+    FORMAT = 'feather'
+except ImportError:
+    FORMAT = 'pickle'
+
+# change when the columns or dtypes of the cached frames change
+CACHE_VERSION = '5'
+
+
+def fingerprint(path):
+    """Fingerprint a file by path, size, modification time and content hash.
+
+    Args:
+        path: path to file
+
+    Returns:
+           fingerprint string
+
+    """
+    stat = os.stat(path)
+    content = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            content.update(block)
+
+    return '\t'.join([os.path.abspath(path), str(stat.st_size), str(stat.st_mtime_ns), content.hexdigest()])
+
+
+def cache_key(*paths, options=None):
+    """Key for the frame parsed from a set of input files.
+
+    The key is a hash of the input files followed by a hash of the options, so
+    frames parsed from the same files with different options are kept side by side.
+
+    Args:
+        paths: paths to input files
+        options: string with the options the frame was parsed with, if any
+
+    Returns:
+           hex key of the inputs and hex key of the options, joined by '-'
+
+    """
+    inputs = hashlib.blake2b(CACHE_VERSION.encode(), digest_size=16)
+    for path in paths:
+        inputs.update(fingerprint(path).encode())
+        inputs.update(b'\n')
+    options_key = hashlib.blake2b(b'' if options is None else b'+' + options.encode(), digest_size=8)
+
+    return inputs.hexdigest() + '-' + options_key.hexdigest()
+
+
+def cache_file(cache_dir, name, key):
+    """Path to the cached frame of a sample.
+
+    Args:
+        cache_dir: cache directory
+        name: sample id
+        key: key from cache_key
+
+    Returns:
+           path
+
+    """
+    return os.path.join(cache_dir, name + '.' + key + '.' + FORMAT)
+
+
+def load(cache_dir, name, key):
+    """Load a cached frame.
+
+    Args:
+        cache_dir: cache directory
+        name: sample id
+        key: key from cache_key
+
+    Returns:
+           pandas DataFrame, or None if not cached
+
+    """
+    path = cache_file(cache_dir, name, key)
+    if not os.path.exists(path):
+        return None
+
+    return read_frame(path)
+
+
+def store(cache_dir, name, key, frame):
+    """Store a frame and remove frames cached for other versions of the sample's input files.
+
+    Frames of the same input files parsed with other options are kept.
+
+    Args:
+        cache_dir: cache directory
+        name: sample id
+        key: key from cache_key
+        frame: pandas DataFrame with a default index
+
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    write_frame(cache_file(cache_dir, name, key), frame)
+
+    for fname in os.listdir(cache_dir):
+        stem, _, extension = fname.rpartition('.')
+        old_name, _, old_key = stem.rpartition('.')
+        if old_name == name and extension == FORMAT and old_key.partition('-')[0] != key.partition('-')[0]:
+            os.remove(os.path.join(cache_dir, fname))
+
+
+def read_frame(path):
+    """Read a frame written by write_frame.
+
+    Args:
+        path: path to frame in FORMAT
+
+    Returns:
+           pandas DataFrame
+
+    """
+    if FORMAT == 'feather':
+        return pd.read_feather(path)
+    return pd.read_pickle(path)
+
+
+def write_frame(path, frame):
+    """Write a frame in FORMAT, atomically replacing path.
+
+    Args:
+        path: path to frame in FORMAT
+        frame: pandas DataFrame with a default index
+
+    """
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    if FORMAT == 'feather':
+        frame.to_feather(tmp_path)
+    else:
+        frame.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
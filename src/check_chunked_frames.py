@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Check that the chunked mode filters synthetic samples like the whole file mode, with indels and repeated keys."""
+
+import argparse
+import os
+import random
+import tempfile
+import numpy as np
+import discovery
+
+STRICT_FILTER = {'minimum_tumor_coverage': 15, 'minimum_normal_coverage': 10, 'maximum_alt_read_normal': 1,
+                 'minimum_alt_read_tumor': 5, 'minimum_vaf_tumor': 5}
+LOOSE_FILTER = {'minimum_tumor_coverage': 8, 'minimum_normal_coverage': 6, 'maximum_alt_read_normal': 2,
+                'minimum_alt_read_tumor': 3, 'minimum_vaf_tumor': 2}
+CLASSIFICATIONS = ['Missense_Mutation', 'Silent', 'Intron', "3'UTR", 'Nonsense_Mutation', 'IGR', 'Splice_Site']
+MAF_COLUMNS = ['Hugo_Symbol', 'Chromosome', 'Start_Position', 'Variant_Classification', 'Reference_Allele', 'Tumor_Seq_Allele2',
+               't_depth', 't_ref_count', 't_alt_count', 'n_depth', 'n_ref_count', 'n_alt_count', 'SYMBOL']
+
+
+def make_variants(rng, count):
+    """Pick random SNVs and indels, indels with the vcf padding base.
+
+    Args:
+        rng: random.Random
+        count: number of variants
+
+    Returns:
+           list of (chromosome, position, reference, alternative) tuples
+
+    """
+    result = []
+    for i in range(count):
+        chrom = rng.choice([str(c) for c in range(1, 23)] + ['X'])
+        pos = rng.randint(1, 10 ** 6)
+        ref = rng.choice('ACGT')
+        if i % 5 == 1:
+            result.append((chrom, pos, ref, ref + rng.choice('ACGT') + rng.choice('ACGT')))
+        elif i % 5 == 2:
+            result.append((chrom, pos, ref + rng.choice('ACGT'), ref))
+        else:
+            result.append((chrom, pos, ref, rng.choice([base for base in 'ACGT' if base != ref])))
+
+    return result
+
+
+def to_maf(variant):
+    """Maf Chromosome, Start_Position, Reference_Allele and Tumor_Seq_Allele2 of a vcf variant."""
+    chrom, pos, ref, alt = variant
+    if len(alt) > len(ref):
+        return chrom, pos, '-', alt[1:]
+    if len(ref) > len(alt):
+        return chrom, pos + 1, ref[1:], '-'
+    return variant
+
+
+def vcf_line(variant, filter_value, normal, tumor):
+    """Vcf line of a variant with normal and tumor (depth, alt count)."""
+    chrom, pos, ref, alt = variant
+    fields = [filter_value, 'DP=1', 'GT:AD:AF:DP']
+    fields += ['0/0:%d,%d:0.01:%d' % (normal[0] - normal[1], normal[1], normal[0]), '0/1:%d,%d:0.1:%d' % (tumor[0] - tumor[1], tumor[1], tumor[0])]
+    return '\t'.join([chrom, str(pos), '.', ref, alt, '.'] + fields) + '\n'
+
+
+def maf_line(variant, classification, normal, tumor):
+    """Maf line of a variant with normal and tumor (depth, alt count)."""
+    chrom, pos, ref, alt = to_maf(variant)
+    symbol = 'GENE' + str(pos % 50)
+    values = [symbol, chrom, str(pos), classification, ref, alt, str(tumor[0]), str(tumor[0] - tumor[1]), str(tumor[1]),
+              str(normal[0]), str(normal[0] - normal[1]), str(normal[1]), symbol]
+    return '\t'.join(values) + '\n'
+
+
+def write_sample(directory, name, rows):
+    """Write the vcf and maf of a sample.
+
+    Args:
+        directory: directory to write to
+        name: sample name
+        rows: list of (vcf line, maf line or None) in file order
+
+    Returns:
+           paths to the vcf and maf files
+
+    """
+    vcf_file = os.path.join(directory, name + '.vcf')
+    maf_file = os.path.join(directory, name + '.maf')
+    with open(vcf_file, 'w') as vcf, open(maf_file, 'w') as maf:
+        vcf.write('##fileformat=VCFv4.2\n##normal_sample=' + name + '_N\n##tumor_sample=' + name + '_T\n')
+        vcf.write('\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT', name + '_N', name + '_T']) + '\n')
+        maf.write('#version 2.4\n' + '\t'.join(MAF_COLUMNS) + '\n')
+        for vcf_row, maf_row in rows:
+            vcf.write(vcf_row)
+            if maf_row is not None:
+                maf.write(maf_row)
+
+    return vcf_file, maf_file
+
+
+def random_sample(directory, name, rng, count):
+    """Write a random sample with indels and repeated vcf and maf keys.
+
+    Repeated vcf keys come back later in the file as REJECT rows with a high VAF,
+    or as PASS rows passing both filters, after a first row of any kind.
+
+    Args:
+        directory: directory to write to
+        name: sample name
+        rng: random.Random
+        count: number of variants
+
+    Returns:
+           paths to the vcf and maf files
+
+    """
+    variants = make_variants(rng, count)
+    rows = []
+    for variant in variants:
+        tumor_depth = rng.randint(1, 120)
+        tumor = (tumor_depth, rng.randint(0, tumor_depth // 3))
+        normal = (rng.randint(2, 80), rng.choice([0, 0, 0, 1, 2]))
+        classification = rng.choice(CLASSIFICATIONS)
+        rows.append((vcf_line(variant, rng.choice(['PASS', 'PASS', 'REJECT', 'REJECT', 't_lod']), normal, tumor),
+                     maf_line(variant, classification, normal, tumor) if rng.random() < 0.95 else None))
+        if rng.random() < 0.05:
+            # repeated maf key with another classification
+            rows.append(('', maf_line(variant, rng.choice(CLASSIFICATIONS), normal, tumor)))
+
+    for i, variant in enumerate(rng.sample(variants, count // 10)):
+        rows.append((vcf_line(variant, 'PASS' if i % 3 == 0 else 'REJECT', (40, 0), (90, 60)), None))
+
+    return write_sample(directory, name, rows)
+
+
+def two_row_sample(directory, name, rng):
+    """Write a sample with one SNV and one indel, the smallest frames to index."""
+    snv, insertion = make_variants(rng, 2)
+    rows = [(vcf_line(variant, 'PASS', (40, 0), (90, 30)), maf_line(variant, 'Missense_Mutation', (40, 0), (90, 30))) for variant in (snv, insertion)]
+    return write_sample(directory, name, rows)
+
+
+def check(name, vcf_file, maf_file, chunksizes):
+    """Compare the chunked filtering of a sample with the whole file filtering.
+
+    Args:
+        name: sample name
+        vcf_file: vcf file
+        maf_file: maf file
+        chunksizes: chunk sizes to check
+
+    Raises:
+        AssertionError: if the filtered SNVs or false positive candidates differ
+
+    """
+    expected = discovery.load_and_filter_sample(name, vcf_file, maf_file, STRICT_FILTER, LOOSE_FILTER)
+    for chunksize in chunksizes:
+        sample = discovery.load_and_filter_sample(name, vcf_file, maf_file, STRICT_FILTER, LOOSE_FILTER, chunksize=chunksize)
+        for part in ('get_strict_filter_snv', 'get_loose_filter_snv'):
+            got, want = getattr(sample, part)(), getattr(expected, part)()
+            columns = ['SNV', 't_depth', 't_alt_count', 'VAF', 'SYMBOL']
+            assert got[columns].astype(str).reset_index(drop=True).equals(want[columns].astype(str).reset_index(drop=True)), (name, part, chunksize)
+        got, want = sample.get_snv_index(), expected.get_snv_index()
+        assert np.array_equal(got.index.to_numpy(), want.index.to_numpy()), (name, 'snv index', chunksize)
+        assert got['FILTER'].astype(str).tolist() == want['FILTER'].astype(str).tolist(), (name, 'snv index', chunksize)
+        assert np.array_equal(got['VAF'].to_numpy(), want['VAF'].to_numpy(), equal_nan=True), (name, 'snv index', chunksize)
+
+
+def main():
+    """Check random samples and a two row sample for several chunk sizes."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seeds', nargs='+', type=int, default=[1, 2, 3], help='random seeds of the samples')
+    parser.add_argument('--variants', type=int, default=300, help='variants per sample')
+    parser.add_argument('--chunksize', nargs='+', type=int, default=[2, 13, 50, 1000], help='chunk sizes to check')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for seed in args.seeds:
+            rng = random.Random(seed)
+            name = 'S' + str(seed)
+            check(name, *random_sample(tmp_dir, name, rng, args.variants), args.chunksize)
+            check(name + '_two', *two_row_sample(tmp_dir, name + '_two', rng), args.chunksize)
+
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
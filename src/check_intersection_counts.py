@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Check of the bitmask upset counts against a groupby over the sample columns."""
+
+import argparse
+import numpy as np
+import pandas as pd
+import variant_matrix
+
+
+def groupby_counts(presence):
+    """Reference counts from a groupby over one boolean column per sample.
+
+    Args:
+        presence: boolean numpy array of shape (variants, samples)
+
+    Returns:
+        boolean numpy array with one row per combination and numpy array of counts
+
+    """
+    columns = ['s' + str(i) for i in range(presence.shape[1])]
+    counts = pd.DataFrame(presence, columns=columns).groupby(columns).size()
+    combinations = np.array([key if isinstance(key, tuple) else (key,) for key in counts.index], dtype=bool).reshape(len(counts), presence.shape[1])
+    return combinations, counts.to_numpy()
+
+
+def check(presence):
+    """Compare intersection_counts with the groupby reference.
+
+    Args:
+        presence: boolean numpy array of shape (variants, samples)
+
+    Raises:
+        AssertionError: if the combinations or counts differ
+
+    """
+    combinations, counts = variant_matrix.intersection_counts(presence)
+    expected_combinations, expected_counts = groupby_counts(presence)
+    assert combinations.shape == expected_combinations.shape, (combinations.shape, expected_combinations.shape)
+    assert (combinations == expected_combinations).all()
+    assert (counts == expected_counts).all()
+
+
+def main():
+    """Check random presence matrices for growing sample counts, and one without variants."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', nargs='+', type=int, default=[1, 3, 8, 9, 64, 65, 70], help='sample counts to check')
+    parser.add_argument('--variants', type=int, default=500, help='variants per check')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    for samples in args.samples:
+        presence = rng.random((args.variants, samples)) < 0.95
+        check(presence[presence.any(axis=1)])
+
+        # no variant reaches min_alt in any sample
+        check(np.zeros((0, samples), dtype=bool))
+
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
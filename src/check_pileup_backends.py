@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Check that the pysam backend of run_samtools.py writes the same lines as samtools mpileup, on a synthetic BAM."""
+
+import argparse
+import io
+import os
+import random
+import tempfile
+import pysam
+import run_samtools
+
+CHROMOSOMES = {'1': 20000, '2': 15000, 'X': 8000}
+
+
+def make_reference(path, rng):
+    """Write a random reference in FASTA format and index it.
+
+    Args:
+        path: path to write the reference to
+        rng: random.Random
+
+    Returns:
+           dictionary from chromosome to sequence
+
+    """
+    sequences = {chrom: ''.join(rng.choice('ACGT') for _ in range(length)) for chrom, length in CHROMOSOMES.items()}
+    with open(path, 'w') as f:
+        for chrom, sequence in sequences.items():
+            f.write('>' + chrom + '\n')
+            for start in range(0, len(sequence), 60):
+                f.write(sequence[start:start + 60] + '\n')
+    pysam.faidx(path)
+
+    return sequences
+
+
+def make_bam(path, sequences, sites, rng, read_length=50):
+    """Write a sorted and indexed BAM of random reads carrying the ALT of sites, with deletions, insertions and mixed qualities.
+
+    Args:
+        path: path to write the BAM to
+        sequences: dictionary from chromosome to sequence
+        sites: list of (chromosome, position, reference, alternative) tuples
+        rng: random.Random
+        read_length: length of the reads
+
+    Returns:
+           list of (chromosome, position) of the last base before an indel, in read order
+
+    """
+    header = {'HD': {'VN': '1.6', 'SO': 'unsorted'}, 'SQ': [{'SN': chrom, 'LN': length} for chrom, length in CHROMOSOMES.items()]}
+    mutations = {(chrom, pos - 1): alt for chrom, pos, ref, alt in sites}
+    unsorted = path + '.unsorted.bam'
+    indels = []
+    with pysam.AlignmentFile(unsorted, 'wb', header=header) as out:
+        number = 0
+        for reference_id, (chrom, length) in enumerate(CHROMOSOMES.items()):
+            sequence = sequences[chrom]
+            for _ in range(length // 4):
+                start = rng.randint(0, length - read_length - 10)
+                bases = list(sequence[start:start + read_length])
+                cigar = [(0, read_length)]
+                for i in range(read_length):
+                    if (chrom, start + i) in mutations and rng.random() < 0.3:
+                        bases[i] = mutations[(chrom, start + i)]
+                if rng.random() < 0.1:
+                    # deletion of 2 bases after 20 bases
+                    bases = bases[:20] + list(sequence[start + 22:start + read_length + 2])
+                    cigar = [(0, 20), (2, 2), (0, read_length - 20)]
+                    indels.append((chrom, start + 20))
+                elif rng.random() < 0.1:
+                    # insertion of 2 bases after 25 bases
+                    bases = bases[:25] + ['A', 'C'] + bases[25:read_length - 2]
+                    cigar = [(0, 25), (1, 2), (0, read_length - 27)]
+                    indels.append((chrom, start + 25))
+
+                read = pysam.AlignedSegment()
+                read.query_name = 'r' + str(number)
+                read.query_sequence = ''.join(bases)
+                read.flag = 16 if rng.random() < 0.5 else 0
+                read.reference_id = reference_id
+                read.reference_start = start
+                read.mapping_quality = rng.choice([0, 10, 30, 60, 60, 60])
+                read.cigartuples = cigar
+                read.query_qualities = pysam.qualitystring_to_array(''.join(chr(33 + rng.randint(2, 40)) for _ in bases))
+                out.write(read)
+                number += 1
+
+    pysam.sort('-o', path, unsorted)
+    pysam.index(path)
+    os.remove(unsorted)
+
+    return indels
+
+
+def make_sites(sequences, rng, count=15):
+    """Pick random SNVs per chromosome, plus a site without reads.
+
+    Args:
+        sequences: dictionary from chromosome to sequence
+        rng: random.Random
+        count: number of SNVs per chromosome
+
+    Returns:
+           list of (chromosome, position, reference, alternative) tuples in random order
+
+    """
+    sites = []
+    for chrom, sequence in sequences.items():
+        for pos in rng.sample(range(200, len(sequence) - 200), count):
+            ref = sequence[pos]
+            sites.append((chrom, pos + 1, ref, rng.choice([base for base in 'ACGT' if base != ref])))
+    rng.shuffle(sites)
+
+    last = CHROMOSOMES['2'] - 10
+    sites.append(('2', last, sequences['2'][last - 1], 'A' if sequences['2'][last - 1] != 'A' else 'C'))
+    return sites
+
+
+def run_bundled_mpileup(key, positions, ref, bam, out_file):
+    """Run the samtools mpileup bundled with pysam for one shard, like run_samtools.run_mpileup."""
+    pysam.samtools.mpileup(*run_samtools.mpileup_arguments(key, positions, ref, bam, out_file + '.bed'), save_stdout=out_file)
+    return out_file
+
+
+def samtools_pileup(sites, baseQ, mapQ, ref, bam, shard_size):
+    """Pileup with the bundled samtools mpileup, sharded and merged like run_samtools.pileup.
+
+    Returns:
+           bytes of the merged lines
+
+    """
+    shards = run_samtools.make_shards(sites, baseQ, mapQ, shard_size)
+    out = io.BytesIO()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shard_files = [run_bundled_mpileup(key, positions, ref, bam, os.path.join(tmp_dir, 'shard_' + str(i) + '.txt'))
+                       for i, (key, positions) in enumerate(shards)]
+        run_samtools.merge_shards(sites, baseQ, mapQ, shards, shard_files, out)
+
+    return out.getvalue()
+
+
+def main():
+    """Compare the pysam backend with samtools mpileup for per-site thresholds, shard sizes and jobs."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', type=int, default=3, help='random seed of the synthetic data')
+    parser.add_argument('--shard_size', nargs='+', type=int, default=[0, 4], help='shard sizes to check, 0 for one shard per bucket and chromosome')
+    parser.add_argument('--jobs', nargs='+', type=int, default=[1, 3], help='jobs to check the pysam backend with')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ref = os.path.join(tmp_dir, 'ref.fa')
+        bam = os.path.join(tmp_dir, 'sample.bam')
+        sequences = make_reference(ref, rng)
+        snvs = make_sites(sequences, rng)
+        indels = make_bam(bam, sequences, snvs, rng)
+
+        # also pileup a few sites where reads have an indel
+        sites = [(chrom, pos, ref_base) for chrom, pos, ref_base, alt in snvs]
+        sites += [(chrom, pos, sequences[chrom][pos - 1]) for chrom, pos in indels[:5]]
+        baseQ = [rng.choice(['5', '20', '60']) for _ in sites]
+        mapQ = [rng.choice(['5', '20']) for _ in sites]
+
+        for shard_size in args.shard_size:
+            expected = samtools_pileup(sites, baseQ, mapQ, ref, bam, shard_size or None)
+            for jobs in args.jobs:
+                out = io.BytesIO()
+                run_samtools.pileup(sites, baseQ, mapQ, ref, bam, out, jobs, 'pysam', shard_size or None)
+                assert out.getvalue() == expected, 'pysam backend differs from samtools mpileup, shard_size ' + str(shard_size) + ', jobs ' + str(jobs)
+
+        lines = expected.decode().splitlines()
+        assert len(lines) == len(sites)
+        assert any(('+' in line.split('\t')[4] or '-' in line.split('\t')[4]) for line in lines), 'no indels in the pileup'
+
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
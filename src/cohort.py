@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Persisted cohort state, so samples can be added or removed without filtering the others again."""
+
+import json
+import os
+import pandas as pd
+import cache
+from sample import Sample
+
+# change when the stored frames or the manifest change
+STATE_VERSION = '2'
+MANIFEST = 'cohort.json'
+PARTS = ['strict', 'loose', 'candidates', 'names']
+
+
+def input_key(*paths):
+    """Key for the input files of a sample from path, size and modification time, without reading them.
+
+    Args:
+        paths: paths to input files
+
+    Returns:
+           key string
+
+    """
+    stats = [(os.path.abspath(path), os.stat(path)) for path in paths]
+    return '\n'.join(path + '\t' + str(stat.st_size) + '\t' + str(stat.st_mtime_ns) for path, stat in stats)
+
+
+def state_file(cohort_dir, sample_id, part):
+    """Path to one stored frame of a sample.
+
+    Args:
+        cohort_dir: cohort directory
+        sample_id: sample id
+        part: one of PARTS
+
+    Returns:
+           path
+
+    """
+    return os.path.join(cohort_dir, sample_id + '.' + part + '.' + cache.FORMAT)
+
+
+def load_manifest(cohort_dir, strict_filter, loose_filter):
+    """Load the manifest of a cohort, empty if it was stored for other filters or another version.
+
+    Args:
+        cohort_dir: cohort directory
+        strict_filter: strict filter
+        loose_filter: loose filter
+
+    Returns:
+           manifest dictionary with version, filters and input key per sample id
+
+    """
+    empty = {'version': STATE_VERSION, 'format': cache.FORMAT, 'strict_filter': strict_filter, 'loose_filter': loose_filter, 'samples': {}}
+    path = os.path.join(cohort_dir, MANIFEST)
+    if not os.path.exists(path):
+        return empty
+
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+
+    if any(manifest.get(key) != empty[key] for key in ('version', 'format', 'strict_filter', 'loose_filter')):
+        return empty
+    return manifest
+
+
+def store_manifest(cohort_dir, manifest):
+    """Store the manifest of a cohort, atomically.
+
+    Args:
+        cohort_dir: cohort directory
+        manifest: manifest dictionary from load_manifest
+
+    """
+    path = os.path.join(cohort_dir, MANIFEST)
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def false_positive_candidates(snv_index, vaf_th):
+    """Rows of an SNV index that can make a SNV a false positive.
+
+    filter.get_false_positives only flags SNVs rejected with a VAF over its threshold,
+    so for thresholds of at least vaf_th the other rows are not needed.
+
+    Args:
+        snv_index: pandas DataFrame with VAF and FILTER indexed by SNV
+        vaf_th: lowest vaf threshold the candidates are used with
+
+    Returns:
+           pandas DataFrame with VAF and FILTER indexed by SNV
+
+    """
+    return snv_index[(snv_index['VAF'] > vaf_th) & (snv_index['FILTER'] == 'REJECT')]
+
+
+def store_sample(cohort_dir, sample, vaf_th):
+    """Store the filtered SNVs, false positive candidates and variant names of a sample.
+
+    Args:
+        cohort_dir: cohort directory
+        sample: sample instance after filtering
+        vaf_th: lowest vaf threshold of the filters
+
+    """
+    os.makedirs(cohort_dir, exist_ok=True)
+    name = sample.get_name()
+    candidates = false_positive_candidates(sample.get_snv_index(), vaf_th)
+    names = sample.get_variant_names()
+
+    cache.write_frame(state_file(cohort_dir, name, 'strict'), sample.get_strict_filter_snv().reset_index(drop=True))
+    cache.write_frame(state_file(cohort_dir, name, 'loose'), sample.get_loose_filter_snv().reset_index(drop=True))
+    cache.write_frame(state_file(cohort_dir, name, 'candidates'),
+                      pd.DataFrame({'SNV': candidates.index.to_numpy(), 'VAF': candidates['VAF'].to_numpy(), 'FILTER': candidates['FILTER'].astype(str).to_numpy()}))
+    cache.write_frame(state_file(cohort_dir, name, 'names'), pd.DataFrame({'SNV': names.index.to_numpy(), 'name': names.to_numpy()}))
+
+
+def load_sample(cohort_dir, sample_id):
+    """Restore a stored sample.
+
+    Args:
+        cohort_dir: cohort directory
+        sample_id: sample id
+
+    Returns:
+           sample instance with filtered SNVs, false positive candidates as SNV index and variant names
+
+    """
+    strict = cache.read_frame(state_file(cohort_dir, sample_id, 'strict'))
+    loose = cache.read_frame(state_file(cohort_dir, sample_id, 'loose'))
+    candidates = cache.read_frame(state_file(cohort_dir, sample_id, 'candidates'))
+    candidates = pd.DataFrame({'VAF': candidates['VAF'].to_numpy(), 'FILTER': candidates['FILTER'].to_numpy()}, index=candidates['SNV'].to_numpy())
+    names = cache.read_frame(state_file(cohort_dir, sample_id, 'names'))
+
+    return Sample.from_filtered(sample_id, strict, loose, candidates, pd.Series(names['name'].to_numpy(), index=names['SNV'].to_numpy(), dtype=object))
+
+
+def stored_sample_ids(cohort_dir):
+    """Ids of the samples with frames in the cohort directory.
+
+    Args:
+        cohort_dir: cohort directory
+
+    Returns:
+           set of sample ids
+
+    """
+    suffixes = ['.' + part + '.' + cache.FORMAT for part in PARTS]
+    sample_ids = set()
+    for fname in os.listdir(cohort_dir) if os.path.isdir(cohort_dir) else []:
+        for suffix in suffixes:
+            if fname.endswith(suffix):
+                sample_ids.add(fname[:-len(suffix)])
+
+    return sample_ids
+
+
+def remove_sample(cohort_dir, sample_id):
+    """Remove the stored frames of a sample.
+
+    Args:
+        cohort_dir: cohort directory
+        sample_id: sample id
+
+    """
+    for part in PARTS:
+        path = state_file(cohort_dir, sample_id, part)
+        if os.path.exists(path):
+            os.remove(path)
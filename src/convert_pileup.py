@@ -3,42 +3,25 @@ import os
 import pandas as pd
 import argparse
 import numpy as np
-import matplotlib.pyplot as plt
-import upsetplot
-import seaborn as sns
-
-
-sns.set()
-
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument('union', type = argparse.FileType('r'),help = 'path to list of SNVs in tsv format annotated with gene symbols')
-parser.add_argument('ref_pileup',nargs = 1,type = argparse.FileType('r'),help = 'file with samtools mpilup output in txt format.txt for the comparison sample ')
-parser.add_argument('pileup_files',nargs = '+',type = argparse.FileType('r'),help='file(s) with samtools mpilup output in txt format,normal sample must be named normal.txt')
-parser.add_argument('--min_alt',nargs = '?',type = int,default = 2,help = 'minimum alt_count,default = 2')
-args = parser.parse_args()
-
-
-
-
+import mpileup
+import plotting
+import variant_matrix
 
 
 
 def generate_result_frames(union,pileup,name,path):
-    pileup = pd.read_csv(pileup, sep= '\t',names=['CHROM', 'POS','REF','DP','PILEUP','baseQ','mapQ','basePosOnReads'] ,header=None)
-    pileup.name = name
-
+    # tokenized pileup, from npz or from samtools mpilup output in txt format
+    pileup = mpileup.load_pileup(pileup, mpileup.union_alts(union['SNV']))
+    if len(pileup['depth']) != len(union):
+        raise ValueError(name + ' has ' + str(len(pileup['depth'])) + ' sites for ' + str(len(union)) + ' SNVs in the union')
 
     # Find out which ALT we are looking for
-    samtools_result = pd.concat([pileup,union],ignore_index=False,axis=1, sort=False)
-
-    samtools_result['ALT'] = samtools_result['SNV'].str.split(':').str[-1]
+    samtools_result = union.copy()
+    samtools_result['DP'] = pileup['depth']
+    samtools_result['ALT'] = mpileup.union_alts(samtools_result['SNV'])
 
     #count the ALT_COUNT and calculate VAF
-
-
-    samtools_result['ALT_COUNT'] = samtools_result.apply(lambda L : L.PILEUP.count(L.ALT) + L.PILEUP.count(L.ALT.lower()) if not pd.isnull(L.PILEUP) else 0, axis =1)
+    samtools_result['ALT_COUNT'] = mpileup.alt_counts(pileup['base_counts'], samtools_result['ALT'])
     samtools_result['VAF'] = samtools_result['ALT_COUNT'] / samtools_result['DP'] * 100
     samtools_result.reset_index(drop=True,inplace=True)
 
@@ -53,50 +36,59 @@ def generate_result_frames(union,pileup,name,path):
 
     return samtools_result
 
-def generate_summary_stats(rapport,names,ref_name,min_alt,path):
-    samples_dicts = {}
-    for name in names:
-        samples_dicts[name] = {}
-        filtered_list = rapport[names]
-        filtered_list = filtered_list.loc[rapport[name].str.split('/').str[0].astype(int) > min_alt]
-
-
-        samples_dicts[name]['count'] = filtered_list[name].count()
-
-
-
+def vaf_matrix(matrix):
+    # VAF in percent of every SNV in every sample, NaN where DP is 0
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return matrix.get_layer('alt_count') / matrix.get_layer('depth') * 100
+
+def generate_rapport(matrix,gene_pos,path):
+    # ALT_COUNT/DP strings are only rendered here, followed by the VAF of each sample
+    vaf = vaf_matrix(matrix)
+    columns = {}
+    for j, name in enumerate(matrix.samples):
+        if name not in columns:
+            columns[name] = pd.Series(matrix.get_layer('alt_count')[:, j]).astype(str).to_numpy() + '/' + pd.Series(matrix.get_layer('depth')[:, j]).astype(str).to_numpy()
+    for j, name in enumerate(matrix.samples):
+        columns['vaf-' + name] = np.round(vaf[:, j],2)
+
+    rapport = pd.DataFrame(columns,index = pd.Index(gene_pos,name = 'GENE:POS'))
+    rapport.to_csv(os.path.join(path,'rapport.tsv'),sep ='\t',index = True)
 
-        filtered_list.loc[:,'vaf-'+ name] = filtered_list[name].str.split('/').str[0].astype(int) / filtered_list[name].str.split('/').str[1].astype(int) * 100
-        rapport.loc[:,'vaf-'+ name] = round(rapport[name].str.split('/').str[0].astype(int) / rapport[name].str.split('/').str[1].astype(int) * 100, 2)
-        samples_dicts[name]['snv'] = filtered_list
-        samples_dicts[name]['total_vaf']= float(filtered_list['vaf-'+ name].sum())
-        samples_dicts[name]['mean'] = round(float(filtered_list['vaf-' + name].mean()),1)
-        samples_dicts[name]['median']  = round(float(filtered_list['vaf-' + name].median()),1)
-        samples_dicts[name]['std'] = round(float(filtered_list['vaf-' + name].std()),1)
-        samples_dicts[name]['min']   = round(float(filtered_list['vaf-' + name].min()),1)
-        samples_dicts[name]['max']  = round(float(filtered_list['vaf-' + name].max()),1)
-        samples_dicts[name]['range'] = str(samples_dicts[name]['min'] ) + '-' + str(samples_dicts[name]['max'])
+    return rapport
 
 
 
-        names_to_use = samples_dicts[ref_name]['snv'].columns.difference(samples_dicts[name]['snv'].columns).tolist()
-        merged = samples_dicts[ref_name]['snv'][names_to_use].merge(samples_dicts[name]['snv'],on=['SNV'])
-        samples_dicts[name]['overlap'] = len(merged)
-        if ((samples_dicts[name]['overlap'] == 0) or (samples_dicts[name]['count'] == 0)):
-            samples_dicts[name]['percent'] = 0
-        else: samples_dicts[name]['percent'] = round((samples_dicts[name]['overlap'] / samples_dicts[name]['count'] * 100),1)
+def generate_summary_stats(matrix,ref_name,min_alt,path):
+    names = matrix.samples
+    vaf = vaf_matrix(matrix)
+    # SNVs with more than min_alt ALT reads, per sample
+    supported = matrix.get_layer('alt_count') > min_alt
 
+    counts = supported.sum(axis = 0)
+    overlaps = (supported & supported[:, [names.index(ref_name)]]).sum(axis = 0)
+    stats = {'count': [], 'overlap': [], 'percent': [], 'mean': [], 'median': [], 'std': [], 'range': []}
+    for j, name in enumerate(names):
+        sample_vaf = pd.Series(vaf[supported[:, j], j])
+        stats['count'].append(counts[j])
+        stats['overlap'].append(int(overlaps[j]))
+        if ((overlaps[j] == 0) or (counts[j] == 0)):
+            stats['percent'].append(0)
+        else: stats['percent'].append(round((overlaps[j] / counts[j] * 100),1))
+        stats['mean'].append(round(float(sample_vaf.mean()),1))
+        stats['median'].append(round(float(sample_vaf.median()),1))
+        stats['std'].append(round(float(sample_vaf.std()),1))
+        stats['range'].append(str(round(float(sample_vaf.min()),1)) + '-' + str(round(float(sample_vaf.max()),1)))
 
 
 
     d1 = {'sample': names\
-    ,'Total snv': [samples_dicts[names[i]]['count'] for i in range(len(names))]\
-    ,'snv overlap with cfdna': [samples_dicts[names[i]]['overlap'] for i in range(len(names))]\
-    ,'% overlap with cfdna': [samples_dicts[names[i]]['percent'] for i in range(len(names))]\
-    ,'mean VAF%':[samples_dicts[names[i]]['mean'] for i in range(len(names))]\
-    ,'median VAF%':[samples_dicts[names[i]]['median'] for i in range(len(names))]\
-    ,'range VAF%':[samples_dicts[names[i]]['range'] for i in range(len(names))]\
-    ,'std VAF%':[samples_dicts[names[i]]['std'] for i in range(len(names))]
+    ,'Total snv': stats['count']\
+    ,'snv overlap with cfdna': stats['overlap']\
+    ,'% overlap with cfdna': stats['percent']\
+    ,'mean VAF%': stats['mean']\
+    ,'median VAF%': stats['median']\
+    ,'range VAF%': stats['range']\
+    ,'std VAF%': stats['std']
     }
     df2 = pd.DataFrame(data=d1)
 
@@ -106,33 +98,32 @@ def generate_summary_stats(rapport,names,ref_name,min_alt,path):
     df2['rank snv overlap'] = ranks.iloc[:,2]
     df2['rank % overlap '] = ranks.iloc[:,3]
 
-    rapport = rapport.set_index('GENE:POS')
-
-    rapport.to_csv(os.path.join(path,'rapport.tsv'),sep ='\t',index = True)
     df2.to_csv(os.path.join(path,'stats.tsv'),sep ='\t',index = False)
 
     return df2
 
 
 
-def generate_upsetplot(rapport,names,min_alt,path):
-    # remove cases with no supporint reads in all samples from alt > min_alt
-    rapport = rapport[rapport[names].apply(lambda alt : False if (alt.str.split('/').str[0].astype(int) < min_alt).all() else True,axis = 1)]
-
-
-    upsetframe = rapport[names].reset_index()
+def generate_upset_counts(matrix,min_alt,path):
+    # SNV count of each combination of samples with alt >= min_alt, cases with no supporting reads in all samples are left out
+    supported = matrix.get_layer('alt_count') >= min_alt
+    supported = supported[supported.any(axis=1)]
 
+    combinations, counts = variant_matrix.intersection_counts(supported)
+    upset_counts = pd.DataFrame(combinations,columns = matrix.samples)
+    upset_counts['count'] = counts
+    upset_counts.to_csv(os.path.join(path,'upset_counts_' + str(min_alt) + '.tsv'),sep ='\t',index = False)
 
-    for name in names:
+    return upset_counts
 
 
-        mask  = (upsetframe[name].str.split('/').str[0].astype(int) >= min_alt)
-        upsetframe.loc[mask,name] = True
-        upsetframe.loc[upsetframe[name] != True,name] = False
 
+def generate_upsetplot(upset_counts,min_alt,path):
+    plt = plotting.pyplot()
+    import upsetplot
 
-    samples = [c for c in upsetframe.columns if c != 'SNV']
-    samples_count_series = upsetframe.fillna(False).groupby(samples).count()['SNV']
+    samples = [c for c in upset_counts.columns if c != 'count']
+    samples_count_series = upset_counts.set_index(samples)['count']
 
     upsetplot.plot(samples_count_series,sort_by='cardinality')
     current_figure = plt.gcf()
@@ -144,7 +135,31 @@ def generate_upsetplot(rapport,names,min_alt,path):
 
 
 
+def plot(argv):
+    # render the plots of an earlier run from its saved upset counts
+    parser = argparse.ArgumentParser(prog = 'convert_pileup.py plot',description = 'render the upset plot from rapports_<min_alt>/upset_counts_<min_alt>.tsv of an earlier run')
+    parser.add_argument('--min_alt',nargs = '?',type = int,default = 2,help = 'minimum alt_count of the run,default = 2')
+    args = parser.parse_args(argv)
+
+    path='rapports_' + str(args.min_alt)
+    upset_counts = pd.read_csv(os.path.join(path,'upset_counts_' + str(args.min_alt) + '.tsv'),sep = '\t')
+    generate_upsetplot(upset_counts,args.min_alt,path)
+
+
+
 def main():
+    if sys.argv[1:2] == ['plot']:
+        plot(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(epilog = "run 'convert_pileup.py plot -h' to render the plots of an earlier run")
+    parser.add_argument('union', type = argparse.FileType('r'),help = 'path to list of SNVs in tsv format annotated with gene symbols')
+    parser.add_argument('ref_pileup',nargs = 1,help = 'file with samtools mpilup output in txt format or tokenized in npz format, for the comparison sample ')
+    parser.add_argument('pileup_files',nargs = '+',help='file(s) with samtools mpilup output in txt format or tokenized in npz format,normal sample must be named normal.txt or normal.npz')
+    parser.add_argument('--min_alt',nargs = '?',type = int,default = 2,help = 'minimum alt_count,default = 2')
+    parser.add_argument('--no-plots',dest = 'plots',action = 'store_false',help = 'only write the tsv files, the upset plot can be rendered later with the plot command')
+    args = parser.parse_args()
+
     union = args.union
     ref = args.ref_pileup[0]
     pileups = args.pileup_files
@@ -155,7 +170,7 @@ def main():
 
     #union = union['SNV']
 
-    name_ref = os.path.abspath(ref.name)
+    name_ref = os.path.abspath(ref)
     name_ref = os.path.basename(name_ref)
     name_ref = ref_name = name_ref.split('.')[0]
     path='rapports_' + str(min_alt)
@@ -165,38 +180,28 @@ def main():
         os.mkdir(path)
 
 
-    ref_frame = generate_result_frames(union,ref,name_ref,path)
-    ref_frame[name_ref] = ref_frame['ALT_COUNT'].astype(str) +'/'+ ref_frame['DP'].astype(str)
-
-
-    frames = [ref_frame[name_ref]]
+    result_frames = [generate_result_frames(union,ref,name_ref,path)]
     names = [name_ref]
     for p in pileups:
-        name = os.path.abspath(p.name)
+        name = os.path.abspath(p)
         name = os.path.basename(name)
         name = name.split('.')[0]
-        result_frame = generate_result_frames(union,p,name,path)
-        result_frame['GENE:POS'] = result_frame['SYMBOL']+ '|' + result_frame.index.str.split(':').str[0] +':'+ result_frame.index.str.split(':').str[1]
-
-        result_frame[name] = result_frame['ALT_COUNT'].astype(str) +'/'+ result_frame['DP'].astype(str)
-
-
-        result_frame[name].head()
-        frames.append(pd.concat([result_frame[name],result_frame['GENE:POS']],axis = 1))
+        result_frames.append(generate_result_frames(union,p,name,path))
         names.append(name)
 
-
-
-    rapport = pd.concat(frames, axis=1)
-    rapport = rapport.loc[:,~rapport.columns.duplicated()]
+    # ALT_COUNT and DP of every sample in one variant x sample matrix
+    matrix = variant_matrix.from_pileups(union['SNV'],names,[f['DP'].to_numpy() for f in result_frames],[f['ALT_COUNT'].to_numpy() for f in result_frames])
 
 
 
     #filter out snv with no supporting reads in any of the samples
-    rapport = rapport[rapport[names].apply(lambda alt : False if (alt.str.split('/').str[0].astype(int) < 2).all() else True,axis = 1)]
+    keep = (matrix.get_layer('alt_count') >= 2).any(axis = 1)
     # filter out SNV with alt_read > 2 in normal if normal is provided
     if "normal" in names:
-        rapport = rapport[rapport["normal"].apply(lambda alt : False if int(alt.split('/')[0]) > 1 else True)]
+        keep &= matrix.get_column('alt_count','normal') <= 1
+    matrix = matrix.take(np.flatnonzero(keep))
+    snv = union.loc[keep,'SNV']
+    gene_pos = (union.loc[keep,'SYMBOL']+ '|' + snv.str.split(':').str[0] +':'+ snv.str.split(':').str[1]).to_numpy()
 
 
 
@@ -204,9 +209,13 @@ def main():
 
 
 
-    generate_upsetplot(rapport,names,min_alt,path)
-    summary_stats = generate_summary_stats(rapport,names,ref_name,min_alt,path)
+    upset_counts = generate_upset_counts(matrix,min_alt,path)
+    rapport = generate_rapport(matrix,gene_pos,path)
+    summary_stats = generate_summary_stats(matrix,ref_name,min_alt,path)
+    if args.plots:
+        generate_upsetplot(upset_counts,min_alt,path)
 
 
 
-main()
+if __name__ == '__main__':
+    main()
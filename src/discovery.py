@@ -4,13 +4,170 @@
 """Main functinality for discovery of SNVs."""
 
 import argparse
+import concurrent.futures
+import itertools
 import parameters
 import frames
 import filter
+import sweep
+import cohort
+import variants
+import variant_matrix
 import os
 import pandas as pd
 
 
+def load_and_filter_sample(sample_id, vcf_file, maf_file, strict_filter, loose_filter, cache_dir=None, chunksize=None):
+    """Load a sample and create its strict and loose filtered SNVs.
+
+    In chunked mode only the rows the filtered SNVs and false positives depend on are kept.
+
+    Args:
+        sample_id: sample id
+        vcf_file: path to vcf file
+        maf_file: path to maf file
+        strict_filter: strict filter
+        loose_filter: loose filter
+        cache_dir: directory to cache parsed samples in, no caching if None
+        chunksize: number of vcf and maf rows read at a time, None to read whole files
+
+    Returns:
+           sample instance without intermediates, with only the false positive candidates as SNV index
+
+    """
+    prune = None if chunksize is None else [strict_filter, loose_filter]
+    sample = frames.make_sample_instance(sample_id, vcf_file, maf_file, cache_dir, chunksize, prune)
+    sample.set_strict_filter(strict_filter)
+    sample.set_loose_filter(loose_filter)
+    sample.create_strict_filtered_snv()
+    sample.create_loose_filtered_snv()
+    sample.release_intermediates()
+
+    # false positive detection only reads the rejected SNVs over the lowest vaf threshold
+    vaf_th = min(strict_filter['minimum_vaf_tumor'], loose_filter['minimum_vaf_tumor'])
+    sample.set_snv_index(cohort.false_positive_candidates(sample.get_snv_index(), vaf_th))
+
+    return sample
+
+
+def map_samples(function, config, sample_ids, jobs, *options):
+    """Call function for each sample, in a pool of jobs processes if jobs > 1.
+
+    Args:
+        function: function of sample id, vcf file, maf file and options
+        config: parameters.Config
+        sample_ids: ids of the samples
+        jobs: number of processes
+        options: further arguments, the same for every sample
+
+    Returns:
+           list of results in sample_ids order
+
+    """
+    arguments = [sample_ids, [config.vcf_files[s] for s in sample_ids], [config.maf_files[s] for s in sample_ids]]
+    arguments += [itertools.repeat(option) for option in options]
+
+    if jobs <= 1 or len(sample_ids) <= 1:
+        return list(map(function, *arguments))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(sample_ids))) as executor:
+        return list(executor.map(function, *arguments))
+
+
+def load_and_filter_samples(config, jobs=1, sample_ids=None):
+    """Load and filter samples, in a pool of jobs processes if jobs > 1.
+
+    Args:
+        config: parameters.Config
+        jobs: number of processes
+        sample_ids: ids of the samples to load, all samples in config if None
+
+    Returns:
+           list of sample instances in config order
+
+    """
+    sample_ids = config.sample_ids if sample_ids is None else sample_ids
+    if not sample_ids:
+        return []
+    return map_samples(load_and_filter_sample, config, sample_ids, jobs,
+                       config.strict_filter, config.loose_filter, config.cache_dir, config.chunksize)
+
+
+def load_cohort(config, cohort_dir, jobs=1):
+    """Load samples from the cohort state, filtering only samples that are new or have changed input files.
+
+    Samples that are no longer in the config are removed from the state. The state
+    is rebuilt if the filters change.
+
+    Args:
+        config: parameters.Config
+        cohort_dir: cohort directory
+        jobs: number of processes to filter changed samples with
+
+    Returns:
+           list of sample instances in config order, with false positive candidates as SNV index,
+           and list of ids of the samples removed from the state
+
+    """
+    manifest = cohort.load_manifest(cohort_dir, config.strict_filter, config.loose_filter)
+    keys = {s: cohort.input_key(config.vcf_files[s], config.maf_files[s]) for s in config.sample_ids}
+
+    stored = cohort.stored_sample_ids(cohort_dir)
+    removed = sorted((stored | set(manifest['samples'])) - set(keys))
+    for sample_id in removed:
+        cohort.remove_sample(cohort_dir, sample_id)
+        manifest['samples'].pop(sample_id, None)
+
+    changed = [s for s in config.sample_ids if s not in stored or manifest['samples'].get(s) != keys[s]]
+    vaf_th = min(config.strict_filter['minimum_vaf_tumor'], config.loose_filter['minimum_vaf_tumor'])
+    for sample in load_and_filter_samples(config, jobs, changed):
+        cohort.store_sample(cohort_dir, sample, vaf_th)
+        manifest['samples'][sample.get_name()] = keys[sample.get_name()]
+
+    os.makedirs(cohort_dir, exist_ok=True)
+    cohort.store_manifest(cohort_dir, manifest)
+
+    return [cohort.load_sample(cohort_dir, s) for s in config.sample_ids], removed
+
+
+def load_sample_arrays(sample_id, vcf_file, maf_file, cache_dir=None, chunksize=None):
+    """Load a sample and get the arrays a threshold sweep needs.
+
+    Args:
+        sample_id: sample id
+        vcf_file: path to vcf file
+        maf_file: path to maf file
+        cache_dir: directory to cache parsed samples in, no caching if None
+        chunksize: number of vcf and maf rows read at a time, None to read whole files
+
+    Returns:
+           sample arrays, see sweep.sample_arrays
+
+    """
+    prune = None if chunksize is None else []
+    sample = frames.make_sample_instance(sample_id, vcf_file, maf_file, cache_dir, chunksize, prune)
+    sample.create_passed_exonic()
+
+    return sweep.sample_arrays(sample)
+
+
+def sweep_thresholds(config, path, jobs=1):
+    """Write SNV counts for every combination of thresholds in the sweep grid to sweep.tsv.
+
+    Thresholds missing from the grid take their value from the strict filter.
+
+    Args:
+        config: parameters.Config
+        path: results directory
+        jobs: number of processes
+
+    """
+    arrays = map_samples(load_sample_arrays, config, config.sample_ids, jobs, config.cache_dir, config.chunksize)
+
+    filters = sweep.parameter_grid(config.sweep, config.strict_filter)
+    sweep.sweep(arrays, filters).to_csv(os.path.join(path, 'sweep.tsv'), sep='\t', index=False)
+
+
 def main():
     """ Program containing the main logic to generate a set of tsv files.
 
@@ -20,40 +177,53 @@ def main():
     """
     parser = argparse.ArgumentParser()
     parser.add_argument('config_file', help='config_file')
+    parser.add_argument('--jobs', type=int, default=1, help='number of samples to load and filter in parallel, default = 1')
+    parser.add_argument('--cache_dir', help='directory to cache parsed samples in, overrides cache_dir in config_file')
+    parser.add_argument('--cohort_dir', help='keep the filtered samples in this directory and only filter new or changed samples, overrides cohort_dir in config_file')
+    parser.add_argument('--chunksize', type=int, help='read vcf and maf files this many rows at a time and keep only the rows filtering needs, overrides chunksize in config_file')
+    parser.add_argument('--sweep', action='store_true', help='only count SNVs for every combination of thresholds in the sweep section of config_file')
     args = parser.parse_args()
-    parameters.get_result_dir(args.config_file)
-    strict_filter = parameters.get_strict_filter_parameters(args.config_file)
-    loose_filter = parameters.get_loose_filter_parameters(args.config_file)
-    vcf_files = parameters.get_vcf_files(args.config_file)
-    maf_files = parameters.get_maf_files(args.config_file)
-    types = parameters.get_type(args.config_file)
+    config = parameters.get_config(args.config_file)
+    if args.cache_dir:
+        config.cache_dir = args.cache_dir
+    if args.cohort_dir:
+        config.cohort_dir = args.cohort_dir
+    if args.chunksize is not None:
+        config.chunksize = parameters.check_chunksize(args.chunksize, '--chunksize')
+    strict_filter = config.strict_filter
+    loose_filter = config.loose_filter
     path = 'results'
 
-    # create sample objects
-    samples = frames.make_sample_instances(vcf_files, maf_files)
-
-    # remove tmp files
-    for fname in os.listdir():
-        if "tmp" in fname:
-            os.remove(fname)
-
     # make results directory
     if not os.path.exists(path):
         os.mkdir(path)
 
-    # create filters defined by user input for each sample
-    for sample in samples:
+    if args.sweep:
+        sweep_thresholds(config, path, args.jobs)
+        return
 
-        sample.set_strict_filter(strict_filter)
-        sample.set_loose_filter(loose_filter)
-        strict_list = sample.create_strict_filtered_snv()
-        loose_list = sample.create_loose_filtered_snv()
+    # create sample objects and filters defined by user input for each sample
+    if config.cohort_dir:
+        samples, removed = load_cohort(config, config.cohort_dir, args.jobs)
+        for sample_id in removed:
+            for suffix in ('_strict.tsv', '_loose.tsv'):
+                if os.path.exists(os.path.join(path, sample_id + suffix)):
+                    os.remove(os.path.join(path, sample_id + suffix))
+    else:
+        samples = load_and_filter_samples(config, args.jobs)
 
-    union_strict = filter.get_union_strict_filtered(samples)
-    union_loose = filter.get_union_loose_filtered(samples)
+    # unions and false positives are reductions over one variant x sample matrix
+    matrix = variant_matrix.from_samples(samples)
+    union_strict = matrix.union('strict')
+    union_loose = matrix.union('loose')
 
-    false_positives_strict = filter.get_false_positives(samples, union_strict, strict_filter['minimum_vaf_tumor'])
-    false_positives_loose = filter.get_false_positives(samples, union_loose, loose_filter['minimum_vaf_tumor'])
+    false_positives_strict = matrix.false_positives(union_strict, strict_filter['minimum_vaf_tumor'])
+    false_positives_loose = matrix.false_positives(union_loose, loose_filter['minimum_vaf_tumor'])
+
+    names = filter.get_variant_names(samples)
+
+    for sample in samples:
+        sample.release_snv_index()
 
     # set false positives for each sample
     for sample in samples:
@@ -61,8 +231,8 @@ def main():
         sample.set_false_positives_strict_filtered(false_positives_strict)
         sample.set_false_positives_loose_filtered(false_positives_loose)
         sample.set_strict_filter_snv_no_false_positives()
-        sample.get_strict_filter_snv_no_false_positives().to_csv(os.path.join(path, sample.get_name() + "_strict.tsv"), sep='\t', index=False)
-        sample.get_loose_filter_snv_no_false_positives().to_csv(os.path.join(path, sample.get_name() + "_loose.tsv"), sep='\t', index=False)
+        variants.render(sample.get_strict_filter_snv_no_false_positives(), names).to_csv(os.path.join(path, sample.get_name() + "_strict.tsv"), sep='\t', index=False)
+        variants.render(sample.get_loose_filter_snv_no_false_positives(), names).to_csv(os.path.join(path, sample.get_name() + "_loose.tsv"), sep='\t', index=False)
 
     union_strict_no_fp = union_strict[(~union_strict.SNV.isin(false_positives_strict.SNV))]
 
@@ -72,14 +242,14 @@ def main():
     union_loose_no_fp_unique = union_loose_no_fp[(~union_loose_no_fp.SNV.isin(common_loose_and_strict.SNV))]
     union = pd.concat([union_strict_no_fp, union_loose_no_fp_unique], ignore_index=True)
 
-    false_positives_strict.to_csv(os.path.join(path, 'false_positives_strict.tsv'), sep='\t', index=False, header=False)
-    false_positives_loose.to_csv(os.path.join(path, 'false_positives_loose.tsv'), sep='\t', index=False)
+    variants.render(false_positives_strict, names).to_csv(os.path.join(path, 'false_positives_strict.tsv'), sep='\t', index=False, header=False)
+    variants.render(false_positives_loose, names).to_csv(os.path.join(path, 'false_positives_loose.tsv'), sep='\t', index=False)
 
-    union_strict_no_fp[['SNV', 'SYMBOL']].to_csv(os.path.join('results', 'union_strict_with_symbol.tsv'), sep='\t', index=False, header=False)
-    union_strict_no_fp[['SNV']].to_csv(os.path.join(path, 'union_strict.tsv'), sep='\t', index=False, header=False)
+    variants.render(union_strict_no_fp[['SNV', 'SYMBOL']], names).to_csv(os.path.join('results', 'union_strict_with_symbol.tsv'), sep='\t', index=False, header=False)
+    variants.render(union_strict_no_fp[['SNV']], names).to_csv(os.path.join(path, 'union_strict.tsv'), sep='\t', index=False, header=False)
 
-    union[['SNV', 'SYMBOL']].to_csv(os.path.join(path, 'union_loose_with_symbol.tsv'), sep='\t', index=False, header=False)
-    union[['SNV']].to_csv(os.path.join(path, 'union_loose.tsv'), sep='\t', index=False, header=False)
+    variants.render(union[['SNV', 'SYMBOL']], names).to_csv(os.path.join(path, 'union_loose_with_symbol.tsv'), sep='\t', index=False, header=False)
+    variants.render(union[['SNV']], names).to_csv(os.path.join(path, 'union_loose.tsv'), sep='\t', index=False, header=False)
 
 
 if __name__ == '__main__':
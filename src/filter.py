@@ -3,7 +3,9 @@
 
 """Filter functions for sample instances."""
 
+import numpy as np
 import pandas as pd
+import variant_matrix
 
 
 def filter_snv(format_field, filter):
@@ -37,6 +39,68 @@ def filter_snv(format_field, filter):
     return passed
 
 
+def parse_format_field(format_column):
+    """Parse a vcf sample column into GT, alternate read and DP columns.
+
+    Args:
+        format_column: pandas Series with format_fields from a vcf file
+
+    Returns:
+        pandas DataFrame with columns GT, AD and DP, where AD is the alternate read count
+
+    """
+    if format_column.empty:
+        return pd.DataFrame({'GT': pd.Series(dtype=object), 'AD': pd.Series(dtype=float), 'DP': pd.Series(dtype=int)}, index=format_column.index)
+
+    splitted = format_column.str.split(':', n=4, expand=True)
+    AD_splitted = splitted[1].str.split(',', n=2, expand=True)
+
+    return pd.DataFrame({'GT': splitted[0],
+                         'AD': AD_splitted[1].astype(float),
+                         'DP': splitted[3].astype(int)}, index=format_column.index)
+
+
+def filter_snv_mask(format_fields, filter):
+    """Test parsed format_fields on a filter, see filter_snv.
+
+    Args:
+        format_fields: pandas DataFrame from parse_format_field
+        filter: dictionary containing filtering thresholds
+
+    Returns:
+        boolean pandas Series, True for passed SNV
+
+    """
+    DP = format_fields['DP']
+    alternate_read = format_fields['AD']
+    heterozygous = format_fields['GT'] == '0/1'
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vaf = alternate_read * 100 / DP
+
+    return threshold_mask(heterozygous, alternate_read, DP, vaf, filter)
+
+
+def threshold_mask(heterozygous, alternate_read, DP, vaf, filter):
+    """Apply filter thresholds, tumor thresholds where heterozygous and normal thresholds otherwise.
+
+    Args:
+        heterozygous: boolean array, True where GT is 0/1
+        alternate_read: array of alternate read counts
+        DP: array of read depths
+        vaf: array of vaf in percent
+        filter: dictionary containing filtering thresholds
+
+    Returns:
+        boolean array, True for passed SNV
+
+    """
+    tumor_passed = (DP >= filter['minimum_tumor_coverage']) & (alternate_read >= filter['minimum_alt_read_tumor']) & (vaf >= filter['minimum_vaf_tumor'])
+    normal_passed = (DP >= filter['minimum_normal_coverage']) & (alternate_read <= filter['maximum_alt_read_normal'])
+
+    return (heterozygous & tumor_passed) | (~heterozygous & normal_passed)
+
+
 def filter_ind(format_field, tum_cov, nor_cov, alt_read_tum, alt_read_nor, vaf_th, type):
     """Test the format_field from indel on a filter.
 
@@ -108,15 +172,7 @@ def get_union_strict_filtered(samples):
         union.
 
     """
-    strict_filtered_snv = []
-    for sample in samples:
-        strict_filtered_snv.append(sample.get_strict_filter_snv())
-
-    strict_filtered_snv_combined = pd.concat(strict_filtered_snv)
-
-    union = strict_filtered_snv_combined[['SNV', 'SYMBOL']].drop_duplicates(subset='SNV', keep='first', inplace=False)
-    union = union.reset_index(drop=True)
-    return union
+    return variant_matrix.from_samples(samples).union('strict')
 
 
 def get_union_loose_filtered(samples):
@@ -129,15 +185,7 @@ def get_union_loose_filtered(samples):
         union.
 
     """
-    loose_filtered_snv = []
-    for sample in samples:
-        loose_filtered_snv.append(sample.get_loose_filter_snv())
-
-    loose_filtered_snv_combined = pd.concat(loose_filtered_snv)
-
-    union = loose_filtered_snv_combined[['SNV', 'SYMBOL']].drop_duplicates(subset='SNV', keep='first', inplace=False)
-    union = union.reset_index(drop=True)
-    return union
+    return variant_matrix.from_samples(samples).union('loose')
 
 
 def is_rejected_with_high_vaf(vaf, status, vaf_th):
@@ -159,7 +207,10 @@ def is_rejected_with_high_vaf(vaf, status, vaf_th):
 
 
 def get_false_positives(samples, union, vaf_th):
-    """Check if SNV is rejected with vaf over threshold.
+    """Find SNVs in the union that are rejected with vaf over threshold in any sample.
+
+    The VAF and FILTER of the union SNVs are read from a variant matrix of the
+    samples' SNV indexes, with a boolean column named after each sample.
 
     Args:
         samples: list of sample instances.
@@ -168,26 +219,24 @@ def get_false_positives(samples, union, vaf_th):
 
 
     Returns:
-        True if rejected, False otherwise
+        false positives, one row per SNV
+
+    """
+    return variant_matrix.from_samples(samples, union['SNV']).false_positives(union, vaf_th)
+
+
+def get_variant_names(samples):
+    """Collect the 'CHROM:POS:REF:ALT' names of the filtered SNVs of all samples.
+
+    Args:
+        samples: list of sample instances.
+
+    Returns:
+        pandas Series of names indexed by SNV key
 
     """
-    for sample in samples:
-        union[sample.get_name()] = False
-        for i in range(len(union) - 1):
-            if sample.snv_is_in_snv_list(union.iloc[i, 0]):
-                vaf = sample.get_snv_vaf(union.iloc[i, 0])
-                status = sample.get_snv_status(union.iloc[i, 0])
-                false_positive = is_rejected_with_high_vaf(vaf, status, vaf_th)
-                column_index = union.columns.get_loc(sample.get_name())
-                union.iloc[i, column_index] = false_positive
-
-    false_positives = pd.DataFrame()
-    for col in union.columns[2:len(union.columns)]:
-        false_positives = false_positives.append(union[union[col]])
-
-    false_positives = false_positives.drop_duplicates(subset='SNV', keep='first', inplace=False)
-
-    return false_positives
+    names = pd.concat([sample.get_variant_names() for sample in samples] + [pd.Series(dtype=object)])
+    return names[~names.index.duplicated(keep='first')]
 
 
 if __name__ == '__main__':
@@ -3,56 +3,278 @@
 
 """Converts vcf and maf files into sample instances."""
 
-from sample import Sample
+from sample import Sample, keep_mask, maf_keep_mask
+import json
+import numpy as np
 import pandas as pd
-import io
+import gzip
+import sys
+import cache
+import schema
+import variants
 
 
-def remove_comments_from_file(infile, outfile):
-    """Remove header from VCF anf MAF files and writes to file.
+def is_vcf(infile):
+    """Check if file is a vcf file, compressed or not.
 
     Args:
-        infile: file to read.
-        outfile: file to write.
+        infile: file name.
+
+    Returns:
+            True for vcf, False otherwise.
+
     """
-    with open(infile, 'r') as inf, open(outfile, 'w') as out:
-        if infile.endswith('vcf'):
-            for line in inf:
-                if not line.startswith('##'):
-                    out.write(line)
-        else:
-            for line in inf:
-                if not line.startswith('#'):
-                    out.write(line)
+    for suffix in ('.gz', '.bgz'):
+        if infile.endswith(suffix):
+            infile = infile[:-len(suffix)]
+    return infile.endswith('vcf')
 
 
-def file_to_pandas_dataframe(infile):
-    """Convert file to pandas DataFrame.
+def open_file(infile):
+    """Open a plain, gzip or bgzip compressed text file for reading.
 
     Args:
         infile: file to read.
 
+    Returns:
+            file handle
+
+    """
+    with open(infile, 'rb') as inf:
+        compressed = inf.read(2) == b'\x1f\x8b'
+
+    if compressed:
+        return gzip.open(infile, 'rt')
+    return open(infile, 'r')
+
+
+def read_header(handle, comment):
+    """Read comment lines and the column header line.
+
+    Args:
+        handle: file handle positioned at the start of the file.
+        comment: prefix of comment lines, '##' for vcf and '#' for maf.
+
+    Returns:
+            list of comment lines, list of column names
+
+    """
+    meta = []
+    line = handle.readline()
+    while line.startswith(comment):
+        meta.append(line.rstrip('\n'))
+        line = handle.readline()
+
+    columns = line.rstrip('\n').split('\t')
+    columns[0] = columns[0].lstrip('#')
+    return meta, columns
+
+
+def read_chunks(infile, fields=None, dtype=None, sample_columns=False, chunksize=None):
+    """Read only the named columns of a file in a single pass, in chunks of rows.
+
+    Args:
+        infile: file to read, may be gzip or bgzip compressed.
+        fields: names of columns to keep, all columns if None.
+        dtype: dictionary from column name to dtype, str for other columns.
+        sample_columns: also keep the normal and tumor sample columns of a vcf, renamed to schema.SAMPLE_COLUMNS.
+        chunksize: number of rows per chunk, the whole file in one chunk if None.
+
+    Yields:
+            pandas DataFrame with columns in the order of fields
+
+    Raises:
+        ValueError: if a column is missing from the header
+
+    """
+    with open_file(infile) as inf:
+        meta, columns = read_header(inf, '##' if is_vcf(infile) else '#')
+        names = list(columns) if fields is None else list(fields)
+        renames = {}
+        if sample_columns:
+            renames = schema.resolve_sample_columns(meta, columns, infile)
+            names += list(renames)
+        positions = schema.resolve_columns(columns, names, infile)
+        dtypes = {position: (dtype or {}).get(name, str) for position, name in zip(positions, names)}
+
+        reader = pd.read_csv(inf, sep='\t', header=None, usecols=positions, dtype=dtypes, chunksize=chunksize)
+        for chunk in ([reader] if chunksize is None else reader):
+            chunk = chunk[positions]
+            chunk.columns = names
+            yield chunk.rename(columns=renames)
+
+
+def file_to_pandas_dataframe(infile, fields=None, dtype=None, sample_columns=False):
+    """Convert file to pandas DataFrame, reading only the named columns in a single pass.
+
+    Args:
+        infile: file to read, may be gzip or bgzip compressed.
+        fields: names of columns to keep, all columns if None.
+        dtype: dictionary from column name to dtype, str for other columns.
+        sample_columns: also keep the normal and tumor sample columns of a vcf, renamed to schema.SAMPLE_COLUMNS.
+
+    Returns:
+            pandas DataFrame with columns in the order of fields
+
+    """
+    return next(read_chunks(infile, fields, dtype, sample_columns))
+
+
+def concat_chunks(chunks, ignore_index=True):
+    """Concatenate chunks, keeping categorical columns categorical.
+
+    Args:
+        chunks: list of pandas DataFrames with the same columns.
+        ignore_index: replace the index of the chunks by a default index.
+
     Returns:
             pandas DataFrame
 
     """
-    with open(infile, 'r') as inf:
-        if infile.endswith('vcf'):
+    frame = pd.concat(chunks, ignore_index=ignore_index)
+    categorical = [column for column, dtype in chunks[0].dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    return frame.astype({column: 'category' for column in categorical})
 
-            lines = [l for l in inf if not l.startswith('##')]
-            dataframe = pd.read_csv(io.StringIO(''.join(lines)), sep='\t', dtype=str).rename(columns={'#CHROM': 'CHROM'})
-        else:
-            dataframe = pd.read_csv(inf, sep='\t', comment='#', dtype=str)
 
-    return dataframe
+def index_maf(maf_file, chunksize=None, prune=None):
+    """Index the maf columns by the variant key of each row.
 
+    With prune, only the rows selected by sample.maf_keep_mask are kept in the
+    index, the keys of the other rows are returned separately.
 
-def make_sample_instances(vcf_files, maf_files):
+    Args:
+        maf_file: maf file.
+        chunksize: number of rows read at a time, the whole file at once if None.
+        prune: list of filters for sample.maf_keep_mask, keep all rows if None.
+
+    Returns:
+            pandas DataFrame with schema.MAF_FIELDS indexed by variant key, the first row per key,
+            and pandas Index of the keys whose first row was pruned
+
+    """
+    dtypes = dict(schema.MAF_DTYPES, **schema.MAF_KEY_DTYPES)
+    chunks = []
+    pruned = []
+    for number, maf_df in enumerate(read_chunks(maf_file, schema.MAF_FIELDS + schema.MAF_KEY_FIELDS, dtypes, chunksize=chunksize)):
+        keys = variants.encode_variants(*[maf_df[field] for field in schema.MAF_KEY_FIELDS])
+        maf_df = maf_df[schema.MAF_FIELDS].set_axis(keys)
+        maf_df = maf_df[~maf_df.index.duplicated(keep='first')]
+        if prune is not None:
+            keep = maf_keep_mask(maf_df, prune)
+            pruned.append(pd.Series(number, index=maf_df.index[~keep]))
+            maf_df = maf_df[keep]
+        chunks.append(maf_df.assign(chunk=number))
+
+    maf_index = concat_chunks(chunks, ignore_index=False)
+    maf_index = maf_index[~maf_index.index.duplicated(keep='first')]
+    pruned = pd.concat(pruned + [pd.Series(dtype=np.int64)])
+    pruned = pruned[~pruned.index.duplicated(keep='first')]
+
+    # a key whose first row was pruned in an earlier chunk has no maf row, like without prune
+    pruned_first = pruned.reindex(maf_index.index).to_numpy(dtype=float, na_value=np.inf) < maf_index['chunk'].to_numpy()
+    maf_index = maf_index[~pruned_first].drop(columns='chunk')
+
+    return maf_index, pruned.index[~pruned.index.isin(maf_index.index)]
+
+
+def load_sample_frame(vcf_file, maf_file, chunksize=None, prune=None):
+    """Load the SNVs of a sample from a vcf file and the maf file annotating it.
+
+    Each vcf row is joined to the maf row with the same chromosome, position and
+    alleles, after normalizing vcf indels to maf conventions. Vcf rows keep their
+    order, those without a maf row get missing maf columns. The number of rows
+    without a match in the other file is reported on stderr.
+
+    With prune, only the maf rows selected by sample.maf_keep_mask and the rows
+    of each chunk selected by sample.keep_mask are kept, so memory scales with
+    the filtered SNVs instead of the whole vcf and maf. Repeated vcf keys that are
+    not PASS are dropped first, so a later row cannot stand in for a pruned first
+    row in the SNV index of the sample.
+
+    Args:
+        vcf_file: vcf file.
+        maf_file: maf file.
+        chunksize: number of vcf and maf rows read at a time, whole files at once if None.
+        prune: list of filters for sample.keep_mask, keep all rows if None.
+
+    Returns:
+            pandas DataFrame with the columns kept from the vcf and maf files and SNV key
+
+    """
+    maf_index, pruned = index_maf(maf_file, chunksize, prune)
+    maf_matched = np.zeros(len(maf_index), dtype=bool)
+    pruned_matched = np.zeros(len(pruned), dtype=bool)
+    vcf_unmatched = 0
+    seen = np.empty(0, dtype=np.int64)
+
+    chunks = []
+    for vcf_df in read_chunks(vcf_file, schema.VCF_FIELDS, schema.VCF_DTYPES, sample_columns=True, chunksize=chunksize):
+        vcf_df['SNV'] = variants.encode_variants(vcf_df['CHROM'], vcf_df['POS'], vcf_df['REF'], vcf_df['ALT'])
+        pos, ref, alt = variants.normalize_to_maf(vcf_df['POS'], vcf_df['REF'], vcf_df['ALT'])
+        keys = variants.encode_variants(vcf_df['CHROM'], pos, ref, alt)
+        rows = maf_index.index.get_indexer(keys)
+        maf_matched[rows[rows >= 0]] = True
+        pruned_rows = pruned.get_indexer(keys[rows < 0])
+        pruned_matched[pruned_rows[pruned_rows >= 0]] = True
+        vcf_unmatched += int((pruned_rows < 0).sum())
+
+        maf_df = maf_index.reindex(keys).set_axis(vcf_df.index)
+        snv = pd.concat([vcf_df, maf_df], axis=1)
+        snv = snv[~(snv['CHROM'].astype(str).str.startswith('G'))]
+        if prune is not None:
+            # later rows of a key only matter to the filters, which need PASS
+            repeated = snv['SNV'].duplicated(keep='first').to_numpy() | np.isin(snv['SNV'].to_numpy(), seen)
+            seen = np.union1d(seen, snv['SNV'].to_numpy())
+            snv = snv[~(repeated & (snv['FILTER'] != 'PASS').to_numpy())]
+            snv = snv[keep_mask(snv, prune)]
+        chunks.append(snv)
+
+    maf_unmatched = int((~maf_matched).sum()) + int((~pruned_matched).sum())
+    if vcf_unmatched or maf_unmatched:
+        print(vcf_file + ': ' + str(vcf_unmatched) + ' vcf rows without maf row, ' + maf_file + ': '
+              + str(maf_unmatched) + ' maf rows without vcf row', file=sys.stderr)
+
+    return concat_chunks(chunks)
+
+
+def make_sample_instance(sample_id, vcf_file, maf_file, cache_dir=None, chunksize=None, prune=None):
+    """Make sample instance from a vcf file and the maf file annotating it.
+
+    Args:
+        sample_id: sample id.
+        vcf_file: vcf file.
+        maf_file: maf file.
+        cache_dir: directory to cache parsed samples in, no caching if None.
+        chunksize: number of vcf and maf rows read at a time, whole files at once if None.
+        prune: list of filters to prune the rows of each chunk with, see load_sample_frame.
+
+    Returns:
+            sample instance
+
+    """
+    snv = None
+    if cache_dir:
+        key = cache.cache_key(vcf_file, maf_file, options=None if prune is None else json.dumps(prune, sort_keys=True))
+        snv = cache.load(cache_dir, sample_id, key)
+
+    if snv is None:
+        snv = load_sample_frame(vcf_file, maf_file, chunksize, prune)
+        if cache_dir:
+            cache.store(cache_dir, sample_id, key, snv)
+
+    snv.name = sample_id
+    return Sample(snv)
+
+
+def make_sample_instances(vcf_files, maf_files, cache_dir=None, chunksize=None, prune=None):
     """Make sample instances.
 
     Args:
         vcf_files: list of vcf files.
         maf_files: liest of maf files
+        cache_dir: directory to cache parsed samples in, no caching if None.
+        chunksize: number of vcf and maf rows read at a time, whole files at once if None.
+        prune: list of filters to prune the rows of each chunk with, see load_sample_frame.
 
     Returns:
             sample instances
@@ -60,14 +282,5 @@ def make_sample_instances(vcf_files, maf_files):
     """
     samples = []
     for sample_id in vcf_files:
-        remove_comments_from_file(vcf_files[sample_id], sample_id + "_tmp.vcf")
-        remove_comments_from_file(maf_files[sample_id], sample_id + "_tmp.maf")
-        vcf_df = file_to_pandas_dataframe(sample_id + "_tmp.vcf")
-        maf_df = file_to_pandas_dataframe(sample_id + "_tmp.maf")
-        vcf_df['SNV'] = vcf_df['CHROM'].astype(str) + ':' + vcf_df['POS'].astype(str) + ':' + vcf_df['REF'].astype(str) + ':' + vcf_df['ALT'].astype(str)
-        snv = pd.concat([vcf_df, maf_df], axis=1)
-        snv = snv.iloc[:, [0, 1, 2, 3, 4, 6, 9, 10, 11, 20, 51, 52, 53, 54, 55, 56, 72]]
-        snv = snv[~(snv['CHROM'].astype(str).str.startswith('G'))]
-        snv.name = sample_id
-        samples.append(Sample(snv))
+        samples.append(make_sample_instance(sample_id, vcf_files[sample_id], maf_files[sample_id], cache_dir, chunksize, prune))
     return samples
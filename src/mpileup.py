@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Tokenize samtools mpileup output once and store it as per-site and per-read arrays in npz files."""
+
+import argparse
+import os
+import re
+import numpy as np
+import pandas as pd
+
+
+BASES = 'ACGTacgt'
+
+# read start with mapping quality, and read end
+READ_MARKERS = re.compile(r'\^.|\$')
+
+# length of an insertion or deletion, followed by its bases
+INDEL = re.compile(r'[+-]([0-9]+)')
+
+# columns of samtools mpileup -s -O output
+PILEUP_COLUMNS = ['CHROM', 'POS', 'REF', 'DP', 'PILEUP', 'baseQ', 'mapQ', 'basePosOnReads']
+
+# maps an ascii code to its column in BASES, other characters to len(BASES)
+BASE_INDEX = np.full(256, len(BASES), dtype=np.intp)
+BASE_INDEX[np.frombuffer(BASES.encode('ascii'), dtype=np.uint8)] = np.arange(len(BASES))
+
+
+def strip_pileup(bases):
+    """Remove read start, read end and indel markers from a mpileup base string.
+
+    The result has one character per read, aligned with the baseQ and mapQ strings.
+
+    Args:
+        bases: base string from mpileup, may be NaN for missing sites
+
+    Returns:
+        read bases
+
+    """
+    if not isinstance(bases, str):
+        return ''
+
+    bases = READ_MARKERS.sub('', bases)
+    if '+' not in bases and '-' not in bases:
+        return bases
+
+    reads = []
+    start = 0
+    indel = INDEL.search(bases)
+    while indel is not None:
+        reads.append(bases[start:indel.start()])
+        start = indel.end() + int(indel.group(1))
+        indel = INDEL.search(bases, start)
+    reads.append(bases[start:])
+
+    return ''.join(reads)
+
+
+def count_bases(reads):
+    """Count the bases in BASES per site in one pass over all sites.
+
+    Args:
+        reads: list of read bases per site, from strip_pileup
+
+    Returns:
+        numpy array with one row per site and one column per base in BASES
+
+    """
+    lengths = np.fromiter((len(r) for r in reads), dtype=np.intp, count=len(reads))
+    codes = np.frombuffer(''.join(reads).encode('ascii'), dtype=np.uint8)
+    site = np.repeat(np.arange(len(reads)), lengths)
+
+    width = len(BASES) + 1
+    counts = np.bincount(site * width + BASE_INDEX[codes], minlength=len(reads) * width)
+
+    return counts.reshape(len(reads), width)[:, :len(BASES)]
+
+
+def alt_counts(counts, alts):
+    """Count reads supporting the ALT base on either strand.
+
+    Args:
+        counts: base counts from count_bases
+        alts: ALT base per site
+
+    Returns:
+        numpy array of ALT counts, 0 for ALT that is not a single base
+
+    """
+    index = np.array([BASES.find(alt.upper()) if isinstance(alt, str) and len(alt) == 1 else -1 for alt in alts], dtype=np.intp)
+    index[index >= 4] = -1
+
+    alt_count = np.zeros(len(index), dtype=counts.dtype)
+    sites = np.flatnonzero(index >= 0)
+    alt_count[sites] = counts[sites, index[sites]] + counts[sites, index[sites] + 4]
+
+    return alt_count
+
+
+def decode_phred(qualities):
+    """Decode a phred quality string to scores.
+
+    Args:
+        qualities: quality string from mpileup
+
+    Returns:
+        numpy array of scores
+
+    """
+    return np.frombuffer(qualities.encode('ascii'), dtype=np.uint8) - 33
+
+
+def alt_reads(reads, alts):
+    """Flag the reads supporting the ALT base on either strand, for all sites at once.
+
+    Args:
+        reads: list of read bases per site, from strip_pileup
+        alts: ALT base per site
+
+    Returns:
+        boolean numpy array over the reads of all sites, number of reads per site
+
+    """
+    lengths = np.fromiter((len(r) for r in reads), dtype=np.intp, count=len(reads))
+    codes = np.frombuffer(''.join(reads).encode('ascii'), dtype=np.uint8)
+    alt_codes = np.array([ord(alt.upper()) if isinstance(alt, str) and len(alt) == 1 else 0 for alt in alts], dtype=np.uint8)
+
+    # clearing bit 0x20 maps lower case bases to upper case and no other pileup character to a letter
+    is_alt = (codes & 0xDF) == np.repeat(alt_codes, lengths)
+
+    return is_alt, lengths
+
+
+def decode_read_scores(qualities, count):
+    """Decode the quality strings of all sites at once.
+
+    Args:
+        qualities: baseQ or mapQ string per site, with one character per read
+        count: number of reads over all sites
+
+    Returns:
+        numpy array of scores over the reads of all sites
+
+    """
+    scores = decode_phred(''.join(q if isinstance(q, str) else '' for q in qualities))
+    if len(scores) != count:
+        raise ValueError('quality strings have ' + str(len(scores)) + ' characters for ' + str(count) + ' reads')
+
+    return scores
+
+
+def site_scores(scores, is_alt, lengths):
+    """Split the scores of ALT reads by site.
+
+    Args:
+        scores: scores over the reads of all sites
+        is_alt: ALT flags from alt_reads
+        lengths: number of reads per site from alt_reads
+
+    Returns:
+        numpy object array with one array of scores per site
+
+    """
+    site = np.repeat(np.arange(len(lengths)), lengths)
+    alt_per_site = np.bincount(site[is_alt], minlength=len(lengths))
+
+    per_site = np.empty(len(lengths), dtype=object)
+    for i, site_scores in enumerate(np.split(scores[is_alt], np.cumsum(alt_per_site)[:-1])):
+        per_site[i] = site_scores
+
+    return per_site
+
+
+def read_pileup_text(pileup_file):
+    """Read samtools mpileup -s -O output.
+
+    Args:
+        pileup_file: path to mpileup output in txt format
+
+    Returns:
+        pandas DataFrame with PILEUP_COLUMNS
+
+    """
+    return pd.read_csv(pileup_file, sep='\t', names=PILEUP_COLUMNS, header=None,
+                       dtype={'CHROM': str, 'REF': str, 'PILEUP': str, 'baseQ': str, 'mapQ': str, 'basePosOnReads': str})
+
+
+def tokenize(pileup, alts):
+    """Tokenize mpileup lines into per-site and per-read arrays.
+
+    Args:
+        pileup: pandas DataFrame from read_pileup_text
+        alts: ALT base per site
+
+    Returns:
+        dictionary of numpy arrays: chrom, pos, ref, alt and depth per site, base_counts with
+        one column per base in BASES, offsets of the reads of each site, and baseQ, mapQ and
+        is_alt per read
+
+    """
+    reads = [strip_pileup(bases) for bases in pileup['PILEUP']]
+    is_alt, lengths = alt_reads(reads, alts)
+
+    return {'chrom': pileup['CHROM'].fillna('').to_numpy(dtype=str),
+            'pos': pileup['POS'].to_numpy(dtype=np.int64),
+            'ref': pileup['REF'].fillna('').to_numpy(dtype=str),
+            'alt': np.array([alt if isinstance(alt, str) else '' for alt in alts], dtype=str),
+            'depth': pileup['DP'].to_numpy(dtype=np.int64),
+            'base_counts': count_bases(reads).astype(np.int32),
+            'offsets': np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            'baseQ': decode_read_scores(pileup['baseQ'], len(is_alt)),
+            'mapQ': decode_read_scores(pileup['mapQ'], len(is_alt)),
+            'is_alt': is_alt}
+
+
+def save_pileup(npz_file, arrays):
+    """Write tokenized pileup arrays to a compressed npz file.
+
+    Args:
+        npz_file: path to npz file
+        arrays: dictionary of numpy arrays from tokenize
+
+    """
+    np.savez_compressed(npz_file, **arrays)
+
+
+def load_pileup(pileup_file, alts=None):
+    """Load tokenized pileup arrays from a npz file, or tokenize mpileup output in txt format.
+
+    Args:
+        pileup_file: path to npz file or mpileup output in txt format
+        alts: ALT base per site, only used for txt files
+
+    Returns:
+        dictionary of numpy arrays, see tokenize
+
+    """
+    if pileup_file.endswith('.npz'):
+        with np.load(pileup_file) as data:
+            return {key: data[key] for key in data.files}
+
+    return tokenize(read_pileup_text(pileup_file), alts)
+
+
+def alt_scores(arrays, quality):
+    """Scores of the ALT reads per site.
+
+    Args:
+        arrays: dictionary of numpy arrays from load_pileup
+        quality: 'baseQ' or 'mapQ'
+
+    Returns:
+        numpy object array with one array of scores per site
+
+    """
+    return site_scores(arrays[quality], arrays['is_alt'], np.diff(arrays['offsets']))
+
+
+def union_alts(snvs):
+    """ALT base of each SNV in the union.
+
+    Args:
+        snvs: pandas Series of 'CHROM:POS:REF:ALT' strings
+
+    Returns:
+        pandas Series of ALT bases
+
+    """
+    return snvs.str.split(':').str[-1]
+
+
+def main():
+    """Tokenize mpileup output in txt format into <name>.npz next to each file."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('union', help='path to list of SNVs in tsv format, in the order of the mpileup lines')
+    parser.add_argument('pileup_files', nargs='+', help='file(s) with samtools mpileup output in txt format')
+    args = parser.parse_args()
+
+    union = pd.read_csv(args.union, sep='\t', header=None, usecols=[0], names=['SNV'])
+    for pileup_file in args.pileup_files:
+        pileup = read_pileup_text(pileup_file)
+        if len(pileup) != len(union):
+            raise ValueError(pileup_file + ' has ' + str(len(pileup)) + ' sites for ' + str(len(union)) + ' SNVs in ' + args.union)
+        save_pileup(os.path.splitext(pileup_file)[0] + '.npz', tokenize(pileup, union_alts(union['SNV'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@
 
 import yaml
 import os
+import functools
 
 try:
     from yaml import CLoader as Loader
@@ -28,6 +29,185 @@ def load_config(config_file):
     return config
 
 
+def check_chunksize(chunksize, source):
+    """Check that chunksize is a positive number of rows, if set.
+
+    Args:
+        chunksize: chunksize from the config file or the command line
+        source: where chunksize was set, for the error message
+
+    Returns:
+           chunksize or None
+
+    """
+    if chunksize is not None and (isinstance(chunksize, bool) or not isinstance(chunksize, int) or chunksize < 1):
+        raise ValueError(source + ' must be a positive number of rows')
+
+    return chunksize
+
+
+FILTER_KEYS = ['minimum_tumor_coverage', 'minimum_normal_coverage', 'maximum_alt_read_normal', 'minimum_alt_read_tumor', 'minimum_vaf_tumor']
+
+
+class Config:
+    """Config file parsed and validated once, with defaults applied and sample paths resolved.
+
+    Args:
+        config_file: config_file
+
+    Attributes:
+        working_dir: working directory, default '.'
+        results_dir: results directory relative to working_dir, default 'results'
+        result_dir: path to results directory
+        strict_filter: strict filter
+        loose_filter: loose filter
+        sample_ids: list of sample ids in config order
+        vcf_files: dictionary from sample id to path to vcf file
+        maf_files: dictionary from sample id to path to maf file
+        types: dictionary from sample id to sample type, default 'tumor'
+        cache_dir: directory to cache parsed samples in, default None for no caching
+        cohort_dir: directory to keep the filtered samples of the cohort in between runs, default None
+        chunksize: number of vcf and maf rows to read at a time, default None to read whole files
+        sweep: dictionary from threshold name to list of values for discovery.py --sweep, default empty
+
+    """
+
+    def __init__(self, config_file):
+        self.config_file = config_file
+        config = load_config(config_file) or {}
+
+        self.working_dir = str(config.get('working_dir') or '.')
+        self.results_dir = str(config.get('results_dir') or 'results')
+        self.result_dir = os.path.join(self.working_dir, self.results_dir)
+        self.cache_dir = config.get('cache_dir')
+        self.cohort_dir = config.get('cohort_dir')
+        self.chunksize = self.validate_chunksize(config)
+        self.sweep = self.validate_sweep(config)
+        self.strict_filter = self.validate_filter(config, 'strict_filter')
+        self.loose_filter = self.validate_filter(config, 'loose_filter')
+
+        samples = config.get('samples')
+        if not isinstance(samples, dict) or not samples:
+            raise ValueError(config_file + ': samples must map sample ids to vcf_file and maf_file')
+
+        self.sample_ids = list(samples)
+        for sample_id in self.sample_ids:
+            missing = [key for key in ('vcf_file', 'maf_file') if not (samples[sample_id] or {}).get(key)]
+            if missing:
+                raise ValueError(config_file + ': sample ' + str(sample_id) + ' has no ' + ' or '.join(missing))
+
+        vcf_files = resolve_paths([samples[s]['vcf_file'] for s in self.sample_ids], self.working_dir)
+        maf_files = resolve_paths([samples[s]['maf_file'] for s in self.sample_ids], self.working_dir)
+        self.vcf_files = dict(zip(self.sample_ids, vcf_files))
+        self.maf_files = dict(zip(self.sample_ids, maf_files))
+        self.types = {s: samples[s].get('type', 'tumor') for s in self.sample_ids}
+
+    def validate_filter(self, config, name):
+        """Check that a filter has a number for every threshold.
+
+        Args:
+            config: parsed config file
+            name: 'strict_filter' or 'loose_filter'
+
+        Returns:
+               filter
+
+        """
+        filter = config.get(name)
+        if not isinstance(filter, dict):
+            raise ValueError(self.config_file + ': ' + name + ' is missing')
+
+        for key in FILTER_KEYS:
+            if isinstance(filter.get(key), bool) or not isinstance(filter.get(key), (int, float)):
+                raise ValueError(self.config_file + ': ' + name + ' needs a number for ' + key)
+
+        return filter
+
+    def validate_chunksize(self, config):
+        """Check that chunksize is a positive number of rows, if set.
+
+        Args:
+            config: parsed config file
+
+        Returns:
+               chunksize or None
+
+        """
+        return check_chunksize(config.get('chunksize'), self.config_file + ': chunksize')
+
+    def validate_sweep(self, config):
+        """Check that the sweep grid has a list of numbers for known thresholds.
+
+        Args:
+            config: parsed config file
+
+        Returns:
+               dictionary from threshold name to list of values
+
+        """
+        sweep = config.get('sweep') or {}
+        if not isinstance(sweep, dict):
+            raise ValueError(self.config_file + ': sweep must map threshold names to lists of values')
+
+        grid = {}
+        for key, values in sweep.items():
+            if key not in FILTER_KEYS:
+                raise ValueError(self.config_file + ': sweep has unknown threshold ' + str(key))
+            values = values if isinstance(values, list) else [values]
+            if not values or any(isinstance(v, bool) or not isinstance(v, (int, float)) for v in values):
+                raise ValueError(self.config_file + ': sweep needs a list of numbers for ' + key)
+            grid[key] = values
+
+        return grid
+
+
+def resolve_paths(paths, working_dir):
+    """Resolve paths relative to the current directory, or else to working_dir.
+
+    Existence is checked with one directory listing per directory instead of a stat per path.
+
+    Args:
+        paths: list of paths from the config file
+        working_dir: working directory
+
+    Returns:
+           list of resolved paths
+
+    """
+    listings = {}
+    resolved = []
+    for path in paths:
+        path = str(path)
+        if os.path.isabs(path):
+            resolved.append(path)
+            continue
+
+        directory, name = os.path.split(path)
+        if directory not in listings:
+            try:
+                listings[directory] = set(os.listdir(directory or '.'))
+            except OSError:
+                listings[directory] = set()
+
+        resolved.append(path if name in listings[directory] else os.path.join(working_dir, path))
+
+    return resolved
+
+
+@functools.lru_cache(maxsize=None)
+def get_config(config_file):
+    """Get config parsed once per config file.
+
+    Args:
+        config_file: config_file
+
+    Returns:
+           Config
+
+    """
+    return Config(config_file)
+
+
 def get_strict_filter_parameters(config_file):
     """Get strict filter from config file.
 
@@ -38,8 +218,7 @@ def get_strict_filter_parameters(config_file):
            strict filter
 
     """
-    config = load_config(config_file)
-    return config['strict_filter']
+    return get_config(config_file).strict_filter
 
 
 def get_loose_filter_parameters(config_file):
@@ -52,8 +231,7 @@ def get_loose_filter_parameters(config_file):
            loose filter
 
     """
-    config = load_config(config_file)
-    return config['loose_filter']
+    return get_config(config_file).loose_filter
 
 
 def get_sample_ids(config_file):
@@ -66,9 +244,7 @@ def get_sample_ids(config_file):
            sample ids
 
     """
-    config = load_config(config_file)
-
-    return config['samples'].keys()
+    return get_config(config_file).sample_ids
 
 
 def get_result_dir(config_file):
@@ -81,9 +257,7 @@ def get_result_dir(config_file):
            results directory
 
     """
-    config = load_config(config_file)
-
-    return os.path.join(config['working_dir'], config['results_dir'])
+    return get_config(config_file).result_dir
 
 
 def get_vcf_files(config_file):
@@ -96,16 +270,7 @@ def get_vcf_files(config_file):
            path to vcf files
 
     """
-    vcf_files = {}
-    config = load_config(config_file)
-
-    for sample_id in get_sample_ids(config_file):
-        if os.path.exists(config['samples'][sample_id]['vcf_file']):
-            vcf_files[sample_id] = config['samples'][sample_id]['vcf_file']
-        else:
-            vcf_files[sample_id] = os.path.join(config['working_dir'], config['samples'][sample_id]['vcf_file'])
-
-    return vcf_files
+    return dict(get_config(config_file).vcf_files)
 
 
 def get_maf_files(config_file):
@@ -118,16 +283,7 @@ def get_maf_files(config_file):
            path to maf files
 
     """
-    maf_files = {}
-    config = load_config(config_file)
-
-    for sample_id in get_sample_ids(config_file):
-        if os.path.exists(config['samples'][sample_id]['maf_file']):
-            maf_files[sample_id] = config['samples'][sample_id]['maf_file']
-        else:
-            maf_files[sample_id] = os.path.join(config['working_dir'], config['samples'][sample_id]['maf_file'])
-
-    return maf_files
+    return dict(get_config(config_file).maf_files)
 
 
 def get_type(config_file):
@@ -140,10 +296,4 @@ def get_type(config_file):
            sample types
 
     """
-    types = {}
-    config = load_config(config_file)
-
-    for sample_id in get_sample_ids(config_file):
-        types[sample_id] = config['samples'][sample_id]['type']
-
-    return types
+    return dict(get_config(config_file).types)
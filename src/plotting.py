@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Lazy matplotlib setup, so scripts only import the plotting libraries when they draw a plot."""
+
+import functools
+import os
+
+
+@functools.lru_cache(maxsize=None)
+def pyplot():
+    """Import matplotlib.pyplot with seaborn styling on first use.
+
+    The plots are only saved to files, so the Agg backend is used unless
+    MPLBACKEND is set, which also works on nodes without a display.
+
+    Returns:
+        matplotlib.pyplot module
+
+    """
+    import matplotlib
+    if 'MPLBACKEND' not in os.environ:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.set()
+
+    return plt
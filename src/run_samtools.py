@@ -1,71 +1,352 @@
-import os
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Run samtools mpileup for the union of SNVs in shards by threshold bucket, chromosome and genomic window."""
+
 import argparse
+import concurrent.futures
+import os
+import subprocess
+import tempfile
+import mpileup
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+
+def read_snvs(union_file):
+    """Read the SNVs in the union.
+
+    Args:
+        union_file: path to list of SNVs in tsv format
+
+    Returns:
+           list of 'CHROM:POS:REF:ALT' strings in union order
+
+    """
+    with open(union_file, 'r') as u:
+        return [line.rstrip('\n').split('\t')[0] for line in u if line.strip()]
+
+
+def read_union(union_file):
+    """Read chromosome, position and reference base of the SNVs in the union.
+
+    Args:
+        union_file: path to list of SNVs in tsv format
+
+    Returns:
+           list of (chromosome, position, reference) tuples in union order
+
+    """
+    sites = []
+    for snv in read_snvs(union_file):
+        chrom, pos, ref = snv.split(':')[:3]
+        sites.append((chrom, int(pos), ref))
+
+    return sites
+
+
+def read_thresholds(threshold_file, default, count):
+    """Read one quality threshold per SNV in the union.
+
+    Args:
+        threshold_file: path to thresholds file in tsv format, or None
+        default: threshold to use for every SNV if threshold_file is None
+        count: number of SNVs in the union
+
+    Returns:
+           list of thresholds as strings
+
+    """
+    if threshold_file is None:
+        return [str(default)] * count
+
+    with open(threshold_file, 'r') as f:
+        thresholds = [line.strip() for line in f if line.strip()]
+
+    if len(thresholds) < count:
+        raise ValueError(threshold_file + ' has ' + str(len(thresholds)) + ' thresholds for ' + str(count) + ' SNVs')
+
+    return thresholds[:count]
+
+
+def make_shards(sites, baseQ, mapQ, shard_size=None):
+    """Group SNVs by baseQ and mapQ threshold and chromosome, and split the groups into windows.
+
+    Args:
+        sites: list of (chromosome, position, reference) tuples
+        baseQ: list of baseQ thresholds
+        mapQ: list of mapQ thresholds
+        shard_size: maximum number of positions per shard, no splitting if None
+
+    Returns:
+           list of ((baseQ, mapQ, chromosome), sorted list of positions) shards
+
+    """
+    groups = {}
+    for (chrom, pos, ref), q, Q in zip(sites, baseQ, mapQ):
+        groups.setdefault((q, Q, chrom), set()).add(pos)
+
+    shards = []
+    for key, positions in groups.items():
+        positions = sorted(positions)
+        size = shard_size or len(positions)
+        for start in range(0, len(positions), size):
+            shards.append((key, positions[start:start + size]))
+
+    return shards
+
+
+def balanced_shard_size(sites, jobs):
+    """Shard size that gives every job a few windows with about the same number of positions.
+
+    Args:
+        sites: list of (chromosome, position, reference) tuples
+        jobs: number of shards to run at a time
+
+    Returns:
+           shard size, or None for one shard per threshold bucket and chromosome if jobs is 1
+
+    """
+    if jobs <= 1:
+        return None
+    return max(1, -(-len(set(sites)) // (4 * jobs)))
+
+
+def mpileup_arguments(key, positions, ref, bam, regions_file):
+    """Write the regions file of one shard and build the samtools mpileup arguments for it.
+
+    Args:
+        key: (baseQ, mapQ, chromosome) of the shard
+        positions: sorted positions
+        ref: path to reference in FASTA format
+        bam: path to sample in BAM format
+        regions_file: path to write the positions to in BED format
+
+    Returns:
+           list of arguments after samtools mpileup, without the output file
+
+    """
+    q, Q, chrom = key
+    with open(regions_file, 'w') as bed:
+        for pos in positions:
+            bed.write(chrom + '\t' + str(pos - 1) + '\t' + str(pos) + '\n')
+
+    region = chrom + ':' + str(positions[0]) + '-' + str(positions[-1])
+    return ['-r', region, '-l', regions_file, '-Q', q, '-q', Q, '-x', '-f', ref, bam, '-s', '-O']
+
+
+def run_mpileup(key, positions, ref, bam, out_file):
+    """Run samtools mpileup for the positions of one shard.
+
+    Args:
+        key: (baseQ, mapQ, chromosome) of the shard
+        positions: sorted positions
+        ref: path to reference in FASTA format
+        bam: path to sample in BAM format
+        out_file: path to write the mpileup lines to, the regions file is written next to it
+
+    Returns:
+           out_file
+
+    """
+    command = ['samtools', 'mpileup'] + mpileup_arguments(key, positions, ref, bam, out_file + '.bed') + ['-o', out_file]
+    subprocess.run(command, check=True)
+
+    return out_file
+
+
+def pileup_line(column, chrom, pos, reference):
+    """Format a pysam pileup column like a line of samtools mpileup -s -O output.
+
+    Args:
+        column: pysam PileupColumn
+        chrom: chromosome
+        pos: 1-based position
+        reference: reference base
+
+    Returns:
+           mpileup line
+
+    """
+    bases = column.get_query_sequences(mark_matches=True, mark_ends=True, add_indels=True)
+    baseQ = ''.join(chr(min(q, 93) + 33) for q in column.get_query_qualities())
+    mapQ = ''.join(chr(min(q, 93) + 33) for q in column.get_mapping_qualities())
+    positions = ','.join(str(p + 1) for p in column.get_query_positions())
+
+    return '\t'.join([chrom, str(pos), reference, str(len(bases)), ''.join(bases), baseQ, mapQ, positions])
+
+
+def run_pysam(key, positions, ref, bam, out_file):
+    """Pileup the positions of one shard with pysam.
+
+    Uses the same read filters as samtools mpileup -x, including BAQ. The shard
+    is read in one pass over the pileup columns from its first to its last
+    position, keeping the columns of its positions.
+
+    Args:
+        key: (baseQ, mapQ, chromosome) of the shard
+        positions: sorted positions
+        ref: path to reference in FASTA format
+        bam: path to sample in BAM format
+        out_file: path to write the mpileup lines to
+
+    Returns:
+           out_file
+
+    """
+    if pysam is None:
+        raise ImportError('the pysam backend requires pysam, install pysam or use --backend samtools')
+
+    q, Q, chrom = key
+    with pysam.AlignmentFile(bam, 'rb') as alignments, pysam.FastaFile(ref) as fasta, open(out_file, 'w') as out:
+        if alignments.get_tid(chrom) < 0:
+            return out_file
+        wanted = set(positions)
+        columns = alignments.pileup(chrom, positions[0] - 1, positions[-1], truncate=True, stepper='samtools', fastafile=fasta,
+                                    min_base_quality=int(q), min_mapping_quality=int(Q), ignore_overlaps=False)
+        for column in columns:
+            pos = column.reference_pos + 1
+            # samtools skips columns where every read is filtered out
+            if pos in wanted and column.get_num_aligned() > 0:
+                out.write(pileup_line(column, chrom, pos, fasta.fetch(chrom, pos - 1, pos)) + '\n')
+
+    return out_file
+
+
+def run_shards(shards, ref, bam, tmp_dir, jobs=1, backend='samtools'):
+    """Pileup shards, jobs at a time, each into its own file in tmp_dir.
+
+    samtools shards run as subprocesses from a thread pool, pysam shards in a process pool.
+
+    Args:
+        shards: list of shards from make_shards
+        ref: path to reference in FASTA format
+        bam: path to sample in BAM format
+        tmp_dir: directory for the shard files
+        jobs: number of shards to run at a time
+        backend: 'samtools' or 'pysam'
+
+    Returns:
+           list of shard file paths, in shard order
+
+    """
+    run = run_pysam if backend == 'pysam' else run_mpileup
+    executor_class = concurrent.futures.ProcessPoolExecutor if backend == 'pysam' else concurrent.futures.ThreadPoolExecutor
+    out_files = [os.path.join(tmp_dir, 'shard_' + str(i) + '.txt') for i in range(len(shards))]
+
+    if jobs <= 1:
+        return [run(key, positions, ref, bam, out_file) for (key, positions), out_file in zip(shards, out_files)]
+
+    with executor_class(max_workers=jobs) as executor:
+        futures = [executor.submit(run, key, positions, ref, bam, out_file) for (key, positions), out_file in zip(shards, out_files)]
+        return [future.result() for future in futures]
+
+
+def index_shard_files(shards, shard_files):
+    """Find the offset of the line of every position in the shard files.
+
+    Args:
+        shards: list of shards from make_shards
+        shard_files: list of shard file paths
+
+    Returns:
+           dictionary from (baseQ, mapQ, chromosome, position) to (shard number, offset)
+
+    """
+    index = {}
+    for number, ((key, positions), shard_file) in enumerate(zip(shards, shard_files)):
+        offset = 0
+        with open(shard_file, 'rb') as f:
+            for line in f:
+                index[key + (int(line.split(b'\t', 2)[1]),)] = (number, offset)
+                offset += len(line)
+
+    return index
+
+
+def merge_shards(sites, baseQ, mapQ, shards, shard_files, out):
+    """Write the shard lines in union order, reading each line from its shard file.
+
+    Args:
+        sites: list of (chromosome, position, reference) tuples
+        baseQ: list of baseQ thresholds
+        mapQ: list of mapQ thresholds
+        shards: list of shards from make_shards
+        shard_files: list of shard file paths
+        out: binary file handle to write to
+
+    """
+    index = index_shard_files(shards, shard_files)
+    handles = [open(shard_file, 'rb') for shard_file in shard_files]
+    try:
+        for (chrom, pos, reference), q, Q in zip(sites, baseQ, mapQ):
+            location = index.get((q, Q, chrom, pos))
+            if location is None:
+                out.write(('\t'.join([chrom, str(pos), reference, '0', '*', '*', '*', '*']) + '\n').encode())
+                continue
+            handle = handles[location[0]]
+            handle.seek(location[1])
+            out.write(handle.readline())
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def pileup(sites, baseQ, mapQ, ref, bam, out, jobs=1, backend='samtools', shard_size=None):
+    """Pileup all SNVs with the samtools or pysam backend and write the lines in union order.
+
+    SNVs without coverage get DP 0, so line i of the output is SNV i of the union.
+
+    Args:
+        sites: list of (chromosome, position, reference) tuples
+        baseQ: list of baseQ thresholds
+        mapQ: list of mapQ thresholds
+        ref: path to reference in FASTA format
+        bam: path to sample in BAM format
+        out: binary file handle to write to
+        jobs: number of shards to run at a time
+        backend: 'samtools' or 'pysam'
+        shard_size: maximum number of positions per shard, balanced over jobs if None
+
+    """
+    shards = make_shards(sites, baseQ, mapQ, shard_size or balanced_shard_size(sites, jobs))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shard_files = run_shards(shards, ref, bam, tmp_dir, jobs, backend)
+        merge_shards(sites, baseQ, mapQ, shards, shard_files, out)
+
+
+def main():
+    """Write samtools mpileup output for the union of SNVs to <name>.txt."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('name', help='sample name')
+    parser.add_argument('ref_fasta', help='path to human genome reference file in FASTA format')
+    parser.add_argument('sample_bam', help='path to sample file in BAM format ')
+    parser.add_argument('union', help='path to list of SNVs in tsv format')
+    parser.add_argument('--baseQ', nargs='?', default=0, help='integer for baseQ threshold')
+    parser.add_argument('--mapQ', nargs='?', default=0, help='integer for mapQ threshold')
+    parser.add_argument('--baseQ_file', nargs='?', help='path to baseQ thresholds file in tsv format')
+    parser.add_argument('--mapQ_file', nargs='?', help='path to mapQ.tsv threshold file in tsv format')
+    parser.add_argument('--jobs', type=int, default=1, help='number of shards to pileup in parallel, default = 1')
+    parser.add_argument('--npz', action='store_true', help='also write the pileup tokenized for convert_pileup.py and quality_score_analysis.py to <name>.npz')
+    parser.add_argument('--shard_size', type=int, help='maximum number of SNVs per shard, default balanced over jobs')
+    parser.add_argument('--backend', choices=['samtools', 'pysam'], default='samtools', help='run samtools mpileup or pileup in process with pysam, default = samtools')
+    args = parser.parse_args()
+
+    sites = read_union(args.union)
+    baseQ = read_thresholds(args.baseQ_file, args.baseQ, len(sites))
+    mapQ = read_thresholds(args.mapQ_file, args.mapQ, len(sites))
+
+    with open(args.name + '.txt', 'wb') as out:
+        pileup(sites, baseQ, mapQ, args.ref_fasta, args.sample_bam, out, args.jobs, args.backend, args.shard_size)
+
+    if args.npz:
+        alts = [snv.split(':')[-1] for snv in read_snvs(args.union)]
+        mpileup.save_pileup(args.name + '.npz', mpileup.tokenize(mpileup.read_pileup_text(args.name + '.txt'), alts))
+
 
-parser = argparse.ArgumentParser()
-parser.add_argument('name',help='sample name')
-parser.add_argument('ref_fasta', type = argparse.FileType('r'),help ='path to human genome reference file in FASTA format')
-parser.add_argument('sample_bam',type = argparse.FileType('r'),help='path to sample file in BAM format ')
-parser.add_argument('union',type = argparse.FileType('r'),help='path to list of SNVs in tsv format')
-parser.add_argument('--baseQ',nargs = '?',default=0,help= 'integer for baseQ threshold')
-parser.add_argument('--mapQ',nargs = '?',default=0,help= 'integer for mapQ threshold')
-parser.add_argument('--baseQ_file',nargs = '?',type = argparse.FileType('r'),help= 'path to baseQ thresholds file in tsv format')
-parser.add_argument('--mapQ_file',nargs = '?',type = argparse.FileType('r'),help= 'path to mapQ.tsv threshold file in tsv format')
-args = parser.parse_args()
-
-baseQ = False
-mapQ = False
-name = args.name
-ref = args.ref_fasta
-bam = args.sample_bam
-union = args.union
-q = args.baseQ
-Q = args.mapQ
-if args.baseQ_file:
-    with open(os.path.abspath(args.baseQ_file)) as f:
-        baseQ_list= f.read().splitlines()
-        baseQ = True
-
-if args.mapQ_file:
-    with open(os.path.abspath(args.mapQ_file)) as f:
-        mapQ_list= f.read().splitlines()
-        mapQ = True
-#case 1
-if baseQ and mapQ:
-    i = 0
-    with open(union ,'r') as u:
-        for line in inf:
-            snv =line.split(".")
-            chrom = snv[0]
-            pos = snv[1]
-            os.system('samtools mpileup -r' + chrom + ':' + pos + '-' + pos + '-q '+ baseQ_list[i] + '-Q ' + mapQ_list[i] + ' -x -f ' + ref + ' ' + bam + ' -s -O  >> ' + name + '.txt')
-            i += 1
-# case 2
-if not baseQ and  mapQ:
-    i = 0
-    with open(union ,'r') as u:
-        for line in inf:
-            snv =line.split(".")
-            chrom = snv[0]
-            pos = snv[1]
-            os.system('samtools mpileup -r' + chrom + ':' + pos + '-' + pos + '-q '+ q + '-Q ' + mapQ_list[i] + ' -x -f ' + ref + ' ' + bam + ' -s -O  >> ' + name + '.txt')
-            i += 1
-
-# case 3
-if baseQ and not mapQ:
-    i = 0
-    with open(union ,'r') as u:
-        for line in inf:
-            snv =line.split(".")
-            chrom = snv[0]
-            pos = snv[1]
-            os.system('samtools mpileup -r' + chrom + ':' + pos + '-' + pos + '-q '+ baseQ_list[i] + '-Q ' + Q + ' -x -f ' + ref + ' ' + bam + ' -s -O  >> ' + name + '.txt')
-            i += 1
-# case 4
-
-if not baseQ and not mapQ:
-    with open(union ,'r') as u:
-        for line in inf:
-            snv =line.split(".")
-            chrom = snv[0]
-            pos = snv[1]
-            os.system('samtools mpileup -r' + chrom + ':' + pos + '-' + pos + '-q '+ q + '-Q ' + Q + ' -x -f ' + ref + ' ' + bam + ' -s -O  >> ' + name + '.txt')
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,179 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """class sample to contain SNVs and filtering functions."""
+import numpy as np
 import pandas as pd
 import filter
+import schema
+import variants
+
+FILTERED_COLUMNS = ['SNV', 't_depth', 't_alt_count', 'VAF', 'SYMBOL']
+
+
+def compute_vaf(snv_list):
+    """VAF in percent from the tumor read counts of a SNV list.
+
+    Args:
+        snv_list: pandas DataFrame with t_depth and t_alt_count
+
+    Returns:
+        numpy float array
+
+    """
+    return pd.to_numeric(snv_list['t_alt_count']).to_numpy(dtype=float, na_value=np.nan) * 100 / pd.to_numeric(snv_list['t_depth']).to_numpy(dtype=float, na_value=np.nan)
+
+
+def exonic_mask(snv_list):
+    """Mask of SNVs with an exonic Variant_Classification, False where it is missing.
+
+    Args:
+        snv_list: pandas DataFrame with Variant_Classification
+
+    Returns:
+        boolean numpy array
+
+    """
+    classification, classifications = pd.factorize(snv_list['Variant_Classification'])
+    return np.array([filter.not_exonic(c) for c in classifications] + [False], dtype=bool)[classification]
+
+
+def passed_exonic_mask(snv_list):
+    """Mask of passed SNVs with an exonic Variant_Classification.
+
+    Args:
+        snv_list: pandas DataFrame with FILTER and Variant_Classification
+
+    Returns:
+        boolean numpy array
+
+    """
+    passed = (snv_list['FILTER'] == 'PASS').to_numpy()
+    return passed & exonic_mask(snv_list)
+
+
+def keep_mask(snv_list, filters):
+    """Mask of the SNVs in a chunk that filtered SNVs and false positives can depend on.
+
+    These are the passed exonic SNVs passing any of filters, all of them if filters
+    is empty, and the rejected SNVs with a VAF over the lowest minimum_vaf_tumor of filters.
+
+    Args:
+        snv_list: pandas DataFrame with SNVs
+        filters: list of filters
+
+    Returns:
+        boolean numpy array
+
+    """
+    keep = passed_exonic_mask(snv_list)
+    if not filters:
+        return keep
+
+    rows = np.flatnonzero(keep)
+    format_fields = [filter.parse_format_field(snv_list[column].take(rows)) for column in schema.SAMPLE_COLUMNS]
+    passed = np.zeros(len(rows), dtype=bool)
+    for filter_parameters in filters:
+        passed |= np.asarray(filter.filter_snv_mask(format_fields[0], filter_parameters) & filter.filter_snv_mask(format_fields[1], filter_parameters))
+    keep[rows[~passed]] = False
+
+    vaf_th = min(filter_parameters['minimum_vaf_tumor'] for filter_parameters in filters)
+    rejected = (snv_list['FILTER'] == 'REJECT').to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        keep |= rejected & (compute_vaf(snv_list) > vaf_th)
+
+    return keep
+
+
+def maf_keep_mask(maf_rows, filters):
+    """Mask of the maf rows that keep_mask can keep a vcf row for.
+
+    keep_mask only keeps exonic SNVs, or with filters also rejected SNVs with a
+    VAF over the lowest minimum_vaf_tumor, and both depend on the maf columns
+    alone. A vcf row whose maf row is not kept gets missing maf columns, which
+    keep_mask drops as well.
+
+    Args:
+        maf_rows: pandas DataFrame with Variant_Classification, t_depth and t_alt_count
+        filters: list of filters
+
+    Returns:
+        boolean numpy array
+
+    """
+    keep = exonic_mask(maf_rows)
+    if not filters:
+        return keep
+
+    vaf_th = min(filter_parameters['minimum_vaf_tumor'] for filter_parameters in filters)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        keep |= compute_vaf(maf_rows) > vaf_th
+
+    return keep
 
 
 class Sample:
     """Class to conatain SNV info and filtering functinality.
 
+    The full SNV list is only held until the filtered SNVs are created,
+    passed exonic SNVs are row positions into it and the SNVs without
+    false positives are masks over the filtered SNVs.
+
     Args:
+        name: sample id
         snv_list: pandas DataFrame with SNVs
         indels_list: pandas DataFrame with indels
         false_positives_strict_filter: pandas DataFrame false positives strict filtered
         false_positives_loose_filter: pandas DataFrame false positives loose filtee
         strict_filtered_snv: pandas DataFrame with strict filtered SNVs
-        strict_filtered_snv_no_false_positives: pandas DataFrame strict filtered SNVs with no FP
-        passed_exonic: pandas DataFrame with passed exonic SNV
+        strict_no_false_positives: boolean mask of strict filtered SNVs that are not false positives
+        loose_no_false_positives: boolean mask of loose filtered SNVs that are not false positives
+        passed_exonic: row positions of passed exonic SNVs in snv_list
+        format_fields: parsed format_fields of the normal and tumor vcf sample columns for passed_exonic
+        snv_index: pandas DataFrame with VAF and FILTER indexed by SNV
+        variant_names: pandas Series with 'CHROM:POS:REF:ALT' of filtered SNVs indexed by SNV key
 
     """
 
+    __slots__ = ['name', 'snv_list', 'indels_list', 'snv_index', 'variant_names', 'strict_filter', 'loose_filter',
+                 'passed_exonic', 'format_fields', 'strict_filtered_snv', 'loose_filtered_snv',
+                 'false_positives_strict_filter', 'false_positives_loose_filter',
+                 'strict_no_false_positives', 'loose_no_false_positives', 'false_positives']
+
     def __init__(self,snv_list = None,indels_list = None):
+        self.name = snv_list.name
         self.snv_list = snv_list
-        self.snv_list['VAF'] = pd.to_numeric(self.snv_list['t_alt_count']) * 100 / pd.to_numeric(self.snv_list['t_depth'])
+        self.snv_index = pd.DataFrame({'VAF': compute_vaf(snv_list), 'FILTER': snv_list['FILTER'].astype('category').array},
+                                      index=snv_list['SNV'].to_numpy())
+        self.snv_index = self.snv_index[~self.snv_index.index.duplicated(keep='first')]
         self.indels_list = indels_list
-        self.false_positives_strict_filter = 0
-        self.false_positives_loose_filter = 0
-        self.strict_filtered_snv = 0
-        self.strict_filtered_snv_no_false_positives = 0
-        self.passed_exonic = 0
+        self.variant_names = pd.Series(dtype=object)
+        self.strict_filter = None
+        self.loose_filter = None
+        self.passed_exonic = np.empty(0, dtype=np.intp)
+        self.format_fields = []
+        self.strict_filtered_snv = None
+        self.loose_filtered_snv = None
+        self.false_positives_strict_filter = None
+        self.false_positives_loose_filter = None
+        self.strict_no_false_positives = None
+        self.loose_no_false_positives = None
+        self.false_positives = None
+
+    @classmethod
+    def from_filtered(cls, name, strict_filtered_snv, loose_filtered_snv, snv_index, variant_names):
+        """Sample with only its filtered SNVs, SNV index and variant names, as restored by cohort.py."""
+        sample = cls.__new__(cls)
+        for slot in cls.__slots__:
+            setattr(sample, slot, None)
+
+        sample.name = name
+        sample.strict_filtered_snv = strict_filtered_snv
+        sample.loose_filtered_snv = loose_filtered_snv
+        sample.snv_index = snv_index
+        sample.variant_names = variant_names
+        sample.passed_exonic = np.empty(0, dtype=np.intp)
+        sample.format_fields = []
+        return sample
 
     def set_strict_filter(self, strict_filter):
         self.strict_filter = strict_filter
@@ -44,36 +190,46 @@ class Sample:
         self.set_loose_filter_snv_no_false_positives()
 
     def set_strict_filter_snv_no_false_positives(self):
-        self.strict_filtered_snv_no_false_positives = self.strict_filtered_snv[(~self.strict_filtered_snv.SNV.isin(self.false_positives_strict_filter.SNV))]
+        self.strict_no_false_positives = ~self.strict_filtered_snv.SNV.isin(self.false_positives_strict_filter.SNV).to_numpy()
 
     def set_loose_filter_snv_no_false_positives(self):
-        loose_filtered_snv_no_false_positives = self.loose_filtered_snv[(~self.loose_filtered_snv.SNV.isin(self.false_positives_loose_filter.SNV))]
-        self.loose_filtered_snv_no_false_positives = pd.concat([loose_filtered_snv_no_false_positives, self.strict_filtered_snv_no_false_positives], ignore_index=True)
+        self.loose_no_false_positives = ~self.loose_filtered_snv.SNV.isin(self.false_positives_loose_filter.SNV).to_numpy()
 
     def get_strict_filter_snv_no_false_positives(self):
-        return self.strict_filtered_snv_no_false_positives
+        return self.strict_filtered_snv[self.strict_no_false_positives]
 
     def get_loose_filter_snv_no_false_positives(self):
-        return self.loose_filtered_snv_no_false_positives
+        return pd.concat([self.loose_filtered_snv[self.loose_no_false_positives], self.get_strict_filter_snv_no_false_positives()], ignore_index=True)
 
     def get_name(self):
-        return self.snv_list.name
+        return self.name
 
     def snv_is_in_snv_list(self, snv):
-        return (self.snv_list['SNV'] == snv).any()
+        return snv in self.snv_index.index
 
     def get_snv_list(self):
         return self.snv_list
 
+    def get_snv_index(self):
+        return self.snv_index
+
+    def set_snv_index(self, snv_index):
+        self.snv_index = snv_index
+
     def get_snv_vaf(self, snv):
-        x = self.snv_list[self.snv_list['SNV'] == snv].index.values.astype(int)[0]
-        y = self.snv_list.columns.get_loc('VAF')
-        return self.snv_list.iloc[x, y]
+        return self.snv_index.at[snv, 'VAF']
 
     def get_snv_status(self, snv):
-        x = self.snv_list[self.snv_list['SNV'] == snv].index.values.astype(int)[0]
-        y = self.snv_list.columns.get_loc('FILTER')
-        return self.snv_list.iloc[x, y]
+        return self.snv_index.at[snv, 'FILTER']
+
+    def get_variant_names(self):
+        return self.variant_names
+
+    def add_variant_names(self, snvs):
+        """Render the names of SNVs that can be written to output."""
+        names = variants.render_variants(snvs['CHROM'], snvs['POS'], snvs['REF'], snvs['ALT'])
+        names.index = snvs['SNV'].to_numpy()
+        self.variant_names = pd.concat([self.variant_names, names])
 
     def get_indels(self):
         return self.indels_list
@@ -90,28 +246,65 @@ class Sample:
     def get_loose_filter_snv(self):
         return self.loose_filtered_snv
 
-    def create_strict_filtered_snv(self):
-        passed = self.snv_list[self.snv_list['FILTER'] == 'PASS']
-        passed_exonic = passed[passed['Variant_Classification'].apply(filter.not_exonic)]
-        passed_exonic = passed_exonic.dropna(subset=['Variant_Classification'])
+    def create_passed_exonic(self):
+        """Select passed exonic SNVs and parse format_fields of both vcf sample columns.
+
+        The raw vcf sample columns are dropped from snv_list once parsed.
+        """
+        self.passed_exonic = np.flatnonzero(passed_exonic_mask(self.snv_list))
 
-        filtered = passed_exonic[passed_exonic.iloc[:, 6].apply(filter.filter_snv, args=(self.strict_filter,))]
-        filtered = filtered[filtered.iloc[:, 7].apply(filter.filter_snv, args=(self.strict_filter,))]
+        self.format_fields = [filter.parse_format_field(self.snv_list[column].take(self.passed_exonic)) for column in schema.SAMPLE_COLUMNS]
+        self.snv_list = self.snv_list.drop(columns=schema.SAMPLE_COLUMNS)
 
-        self.strict_filtered_snv = filtered.loc[:, ['SNV', 't_depth', 't_alt_count', 'VAF', 'SYMBOL']]
-        self.passed_exonic = passed_exonic
+        return self.get_passed_exonic()
+
+    def get_passed_exonic(self):
+        return self.snv_list.take(self.passed_exonic)
+
+    def get_format_fields(self):
+        return self.format_fields
+
+    def filtered_snv(self, rows):
+        """Filtered SNVs from row positions in snv_list, with VAF."""
+        filtered = self.snv_list.take(rows)
+        self.add_variant_names(filtered)
+        filtered = filtered.assign(VAF=compute_vaf(filtered))
+        return filtered.loc[:, FILTERED_COLUMNS]
+
+    def create_strict_filtered_snv(self):
+        self.create_passed_exonic()
+
+        rows = self.passed_exonic[self.get_filter_mask(self.strict_filter)]
+        self.strict_filtered_snv = self.filtered_snv(rows)
 
         return self.strict_filtered_snv
 
     def create_loose_filtered_snv(self):
-        removed_strict_filtered = self.passed_exonic[(~self.passed_exonic.SNV.isin(self.strict_filtered_snv.SNV))]
+        not_strict_filtered = ~self.snv_list['SNV'].take(self.passed_exonic).isin(self.strict_filtered_snv.SNV).to_numpy()
 
-        filtered = removed_strict_filtered[removed_strict_filtered .iloc[:, 6].apply(filter.filter_snv, args=(self.loose_filter,))]
-        filtered = filtered[filtered.iloc[:, 7].apply(filter.filter_snv, args=(self.loose_filter,))]
-
-        self.loose_filtered_snv = filtered.loc[:, ['SNV', 't_depth', 't_alt_count', 'VAF', 'SYMBOL']]
+        rows = self.passed_exonic[not_strict_filtered & self.get_filter_mask(self.loose_filter)]
+        self.loose_filtered_snv = self.filtered_snv(rows)
 
         return self.loose_filtered_snv
 
+    def release_intermediates(self):
+        """Free the SNV list and parsed format_fields once the filtered SNVs are created.
+
+        The sample keeps its name, SNV index and filtered SNVs, which is all the
+        cross-sample stages need, so it stays small when sent between processes.
+        """
+        self.snv_list = None
+        self.passed_exonic = np.empty(0, dtype=np.intp)
+        self.format_fields = []
+
+    def release_snv_index(self):
+        """Free the SNV index once the false positives of the union are found."""
+        self.snv_index = None
+
+    def get_filter_mask(self, filter_parameters):
+        """Mask of passed exonic SNVs where both vcf sample columns pass a filter."""
+        masks = [filter.filter_snv_mask(format_fields, filter_parameters) for format_fields in self.format_fields]
+        return np.asarray(masks[0] & masks[1])
+
     def set_false_positives(self, false_positives):
         self.false_positives = false_positives
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Columns read from vcf and maf files, resolved by header name."""
+
+
+# columns kept from the vcf, besides the tumor and normal sample columns
+VCF_FIELDS = ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'FILTER']
+VCF_DTYPES = {'CHROM': 'category', 'POS': 'int64', 'ID': str, 'REF': 'category', 'ALT': 'category', 'FILTER': 'category'}
+
+# internal names of the vcf sample columns
+NORMAL = 'NORMAL'
+TUMOR = 'TUMOR'
+SAMPLE_COLUMNS = [NORMAL, TUMOR]
+
+# vcf header lines naming the sample columns
+SAMPLE_HEADERS = {'##normal_sample=': NORMAL, '##tumor_sample=': TUMOR}
+
+# maf columns the vcf rows are joined on
+MAF_KEY_FIELDS = ['Chromosome', 'Start_Position', 'Reference_Allele', 'Tumor_Seq_Allele2']
+MAF_KEY_DTYPES = {'Chromosome': str, 'Start_Position': 'int64', 'Reference_Allele': str, 'Tumor_Seq_Allele2': str}
+
+# columns kept from the maf: Variant_Classification, tumor and normal read counts and SYMBOL
+MAF_FIELDS = ['Variant_Classification', 't_depth', 't_ref_count', 't_alt_count', 'n_depth', 'n_ref_count', 'n_alt_count', 'SYMBOL']
+MAF_DTYPES = {'Variant_Classification': 'category', 't_depth': 'Int32', 't_ref_count': 'Int32', 't_alt_count': 'Int32',
+              'n_depth': 'Int32', 'n_ref_count': 'Int32', 'n_alt_count': 'Int32', 'SYMBOL': str}
+
+
+def resolve_columns(columns, fields, infile):
+    """Find the position of each field in a header.
+
+    Args:
+        columns: column names from the header
+        fields: names of the columns to read
+        infile: file name, for the error message
+
+    Returns:
+        list of positions, in the order of fields
+
+    Raises:
+        ValueError: if any field is missing from the header
+
+    """
+    missing = [field for field in fields if field not in columns]
+    if missing:
+        raise ValueError(infile + ': missing columns ' + ', '.join(missing))
+
+    return [columns.index(field) for field in fields]
+
+
+def resolve_sample_columns(meta, columns, infile):
+    """Find the normal and tumor sample columns of a vcf.
+
+    The columns are named by the ##normal_sample= and ##tumor_sample= header
+    lines. Without them the two columns after FORMAT are taken as normal and tumor.
+
+    Args:
+        meta: list of ## header lines
+        columns: column names from the header
+        infile: file name, for the error message
+
+    Returns:
+        dictionary from vcf column name to internal name, in the order of SAMPLE_COLUMNS
+
+    Raises:
+        ValueError: if a named sample column is missing from the header
+
+    """
+    names = {}
+    for line in meta:
+        for prefix, internal in SAMPLE_HEADERS.items():
+            if line.startswith(prefix):
+                names[internal] = line[len(prefix):].strip()
+
+    if len(names) < len(SAMPLE_COLUMNS):
+        format_column = resolve_columns(columns, ['FORMAT'], infile)[0]
+        samples = columns[format_column + 1:format_column + 1 + len(SAMPLE_COLUMNS)]
+        if len(samples) < len(SAMPLE_COLUMNS):
+            raise ValueError(infile + ': expected ' + str(len(SAMPLE_COLUMNS)) + ' sample columns after FORMAT')
+        names = dict(zip(SAMPLE_COLUMNS, samples))
+
+    resolve_columns(columns, [names[internal] for internal in SAMPLE_COLUMNS], infile)
+    return {names[internal]: internal for internal in SAMPLE_COLUMNS}
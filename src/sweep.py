@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Sweep filter thresholds over the parsed format_fields of samples."""
+
+import itertools
+import numpy as np
+import pandas as pd
+import filter
+import parameters
+
+
+def parameter_grid(grid, defaults):
+    """Make every combination of the thresholds in grid.
+
+    Args:
+        grid: dictionary from threshold name to list of values
+        defaults: filter with the values of thresholds missing from grid
+
+    Returns:
+        list of filters
+
+    """
+    values = [grid.get(key, [defaults[key]]) for key in parameters.FILTER_KEYS]
+    return [dict(zip(parameters.FILTER_KEYS, combination)) for combination in itertools.product(*values)]
+
+
+def sample_arrays(sample):
+    """Get the per-variant arrays a sweep needs from the passed exonic SNVs of a sample.
+
+    Args:
+        sample: sample instance after create_passed_exonic
+
+    Returns:
+        dictionary with name, SNV and heterozygous, AD, DP and vaf arrays for both vcf sample columns
+
+    """
+    columns = []
+    for format_fields in sample.get_format_fields():
+        DP = format_fields['DP'].to_numpy()
+        AD = format_fields['AD'].to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vaf = AD * 100 / DP
+        columns.append({'heterozygous': (format_fields['GT'] == '0/1').to_numpy(), 'AD': AD, 'DP': DP, 'vaf': vaf})
+
+    return {'name': sample.get_name(), 'SNV': sample.get_passed_exonic()['SNV'].to_numpy(), 'columns': columns}
+
+
+def sweep(arrays, filters):
+    """Count filtered SNVs per sample and in the union for every filter.
+
+    Args:
+        arrays: list of sample_arrays per sample
+        filters: list of filters, from parameter_grid
+
+    Returns:
+        pandas DataFrame with one row per filter, its thresholds, SNV count per sample and union count
+
+    """
+    # one integer code per distinct SNV across samples, so the union is a boolean mask
+    codes, snvs = pd.factorize(np.concatenate([a['SNV'] for a in arrays] + [np.empty(0, dtype=object)]))
+    offsets = np.cumsum([0] + [len(a['SNV']) for a in arrays])
+
+    rows = []
+    for filter_parameters in filters:
+        row = dict(filter_parameters)
+        in_union = np.zeros(len(snvs), dtype=bool)
+        for a, start, end in zip(arrays, offsets[:-1], offsets[1:]):
+            passed = np.ones(end - start, dtype=bool)
+            for column in a['columns']:
+                passed &= filter.threshold_mask(column['heterozygous'], column['AD'], column['DP'], column['vaf'], filter_parameters)
+            row[a['name']] = int(passed.sum())
+            in_union[codes[start:end][passed]] = True
+        row['union'] = int(in_union.sum())
+        rows.append(row)
+
+    return pd.DataFrame(rows, columns=parameters.FILTER_KEYS + [a['name'] for a in arrays] + ['union'])
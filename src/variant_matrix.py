@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Variant x sample matrix that the cross-sample stages read."""
+
+import numpy as np
+import pandas as pd
+
+
+class VariantMatrix:
+    """Variants as rows and samples as columns, with one numpy array of shape (variants, samples) per layer.
+
+    Layers with missing values are float arrays with NaN. Coded layers, like the
+    symbol layers, hold positions into their categories and -1 where missing.
+
+    Args:
+        variants: pandas Index of variant keys, one per row
+        samples: list of sample names, one per column
+        layers: dictionary from layer name to numpy array
+        categories: dictionary from coded layer name to numpy array of categories
+
+    """
+
+    __slots__ = ['variants', 'samples', 'layers', 'categories']
+
+    def __init__(self, variants, samples, layers=None, categories=None):
+        self.variants = pd.Index(variants)
+        self.samples = list(samples)
+        self.layers = dict(layers or {})
+        self.categories = dict(categories or {})
+
+    def shape(self):
+        return len(self.variants), len(self.samples)
+
+    def get_layer(self, name):
+        return self.layers[name]
+
+    def set_layer(self, name, values, categories=None):
+        values = np.asarray(values)
+        if values.shape != self.shape():
+            raise ValueError('layer ' + name + ' has shape ' + str(values.shape) + ' for a ' + str(self.shape()) + ' matrix')
+        self.layers[name] = values
+        if categories is not None:
+            self.categories[name] = np.asarray(categories, dtype=object)
+
+    def get_column(self, name, sample):
+        return self.layers[name][:, self.samples.index(sample)]
+
+    def rows(self, variants):
+        """Row positions of variants, -1 for variants not in the matrix."""
+        return self.variants.get_indexer(pd.Index(variants))
+
+    def take(self, rows):
+        """Matrix of the variants at row positions, with the same samples."""
+        return VariantMatrix(self.variants[rows], self.samples, {name: values[rows] for name, values in self.layers.items()}, self.categories)
+
+    def decode(self, name, rows, columns):
+        """Categories of a coded layer at (rows, columns) pairs, None where missing."""
+        codes = self.layers[name][rows, columns]
+        values = np.append(self.categories[name], None)
+        return values[np.where(codes < 0, len(values) - 1, codes)]
+
+    def union(self, name):
+        """Union of the samples' filtered sets, in the order of first occurrence in the sets concatenated in sample order.
+
+        Args:
+            name: 'strict' or 'loose', a layer name_rank with the position of each variant in a sample's set, -1 if not in it
+
+        Returns:
+            pandas DataFrame with SNV and the SYMBOL of the first occurrence
+
+        """
+        rank = self.layers[name + '_rank']
+        member = rank >= 0
+        rows = np.flatnonzero(member.any(axis=1))
+        first_sample = member[rows].argmax(axis=1)
+        rows = rows[np.lexsort((rank[rows, first_sample], first_sample))]
+        first_sample = member[rows].argmax(axis=1)
+
+        return pd.DataFrame({'SNV': self.variants[rows].to_numpy(), 'SYMBOL': self.decode(name + '_symbol', rows, first_sample)})
+
+    def false_positives(self, union, vaf_th):
+        """Variants of a union rejected with a VAF over vaf_th in any sample.
+
+        Args:
+            union: pandas DataFrame with SNV and SYMBOL
+            vaf_th: vaf threshold
+
+        Returns:
+            pandas DataFrame with the union columns and one boolean column per sample, ordered
+            by the first sample flagging a variant and then by union order
+
+        """
+        rows = self.rows(union['SNV'])
+        found = rows >= 0
+        flagged = np.zeros((len(union), len(self.samples)), dtype=bool)
+        with np.errstate(invalid='ignore'):
+            flagged[found] = (self.layers['vaf'][rows[found]] > vaf_th) & (self.layers['rejected'][rows[found]])
+
+        false_positives = union.reset_index(drop=True).assign(**{sample: flagged[:, j] for j, sample in enumerate(self.samples)})
+        any_flagged = np.flatnonzero(flagged.any(axis=1))
+        first_sample = flagged[any_flagged].argmax(axis=1)
+        order = any_flagged[np.lexsort((any_flagged, first_sample))]
+
+        false_positives = false_positives.iloc[order]
+        false_positives.index = union.index[order]
+        return false_positives
+
+
+def intersection_counts(presence):
+    """Count the variants of each combination of samples they are present in.
+
+    Presence is packed into a bitmask per variant, one bit per sample in bytes,
+    so any number of samples is supported, and the distinct bitmasks are counted.
+
+    Args:
+        presence: boolean numpy array of shape (variants, samples)
+
+    Returns:
+        boolean numpy array with one row per combination, ordered like a groupby over
+        the sample columns, and numpy array with the number of variants of each combination
+
+    """
+    samples = presence.shape[1]
+    masks = np.packbits(presence, axis=1)
+    masks, counts = np.unique(masks, axis=0, return_counts=True)
+    return np.unpackbits(masks, axis=1, count=samples).astype(bool), counts
+
+
+def from_samples(samples, variants=None):
+    """Build the matrix of filtered SNVs and SNV index values of samples.
+
+    Layers:
+        strict_rank, loose_rank: position of the variant in the sample's strict or loose filtered SNVs, -1 if not in them
+        strict_symbol, loose_symbol: SYMBOL of that row, coded
+        depth, alt_count: t_depth and t_alt_count of the filtered SNV, NaN if not filtered in the sample
+        vaf: VAF from the sample's SNV index, NaN if not in it
+        rejected: FILTER is REJECT in the sample's SNV index
+
+    Args:
+        samples: list of sample instances after filtering
+        variants: variant keys of the rows, all filtered SNVs in first occurrence order if None
+
+    Returns:
+        VariantMatrix
+
+    """
+    strict = [sample.get_strict_filter_snv() for sample in samples]
+    loose = [sample.get_loose_filter_snv() for sample in samples]
+    filtered = [f for f in strict + loose if f is not None]
+
+    if variants is None:
+        variants = pd.unique(np.concatenate([f['SNV'].to_numpy() for f in filtered] + [np.empty(0, dtype=np.int64)]))
+    matrix = VariantMatrix(variants, [sample.get_name() for sample in samples])
+
+    symbols = pd.Index(pd.unique(pd.concat([f['SYMBOL'] for f in filtered] + [pd.Series(dtype=object)]).dropna()))
+    shape = matrix.shape()
+    layers = {'strict_rank': np.full(shape, -1, dtype=np.int64), 'loose_rank': np.full(shape, -1, dtype=np.int64),
+              'strict_symbol': np.full(shape, -1, dtype=np.int64), 'loose_symbol': np.full(shape, -1, dtype=np.int64),
+              'depth': np.full(shape, np.nan), 'alt_count': np.full(shape, np.nan),
+              'vaf': np.full(shape, np.nan), 'rejected': np.zeros(shape, dtype=bool)}
+
+    for j, sample in enumerate(samples):
+        for name, frame in (('strict', strict[j]), ('loose', loose[j])):
+            if frame is None:
+                continue
+            # the first row of a variant in the set, like drop_duplicates(keep='first')
+            first = ~frame['SNV'].duplicated(keep='first').to_numpy()
+            rows = matrix.rows(frame['SNV'][first])
+            found = rows >= 0
+            positions = np.flatnonzero(first)[found]
+            rows = rows[found]
+            layers[name + '_rank'][rows, j] = positions
+            layers[name + '_symbol'][rows, j] = symbols.get_indexer(frame['SYMBOL'].iloc[positions])
+            layers['depth'][rows, j] = pd.to_numeric(frame['t_depth'].iloc[positions]).to_numpy(dtype=float, na_value=np.nan)
+            layers['alt_count'][rows, j] = pd.to_numeric(frame['t_alt_count'].iloc[positions]).to_numpy(dtype=float, na_value=np.nan)
+
+        snv_index = sample.get_snv_index()
+        if snv_index is not None:
+            hits = snv_index.reindex(matrix.variants)
+            layers['vaf'][:, j] = hits['VAF'].to_numpy(dtype=float, na_value=np.nan)
+            layers['rejected'][:, j] = (hits['FILTER'] == 'REJECT').to_numpy()
+
+    for name, values in layers.items():
+        matrix.set_layer(name, values, symbols.to_numpy() if name.endswith('_symbol') else None)
+
+    return matrix
+
+
+def from_pileups(variants, samples, depth, alt_count):
+    """Build the matrix of pileup depth and ALT count of samples.
+
+    Args:
+        variants: variant keys of the rows
+        samples: list of sample names
+        depth: list of depth arrays per sample
+        alt_count: list of ALT count arrays per sample
+
+    Returns:
+        VariantMatrix with depth and alt_count layers
+
+    """
+    matrix = VariantMatrix(variants, samples)
+    matrix.set_layer('depth', np.column_stack(depth) if depth else np.empty(matrix.shape(), dtype=np.int64))
+    matrix.set_layer('alt_count', np.column_stack(alt_count) if alt_count else np.empty(matrix.shape(), dtype=np.int64))
+    return matrix
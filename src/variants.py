@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Pack variants into 64-bit integer keys and render them as 'CHROM:POS:REF:ALT'."""
+
+import hashlib
+import zlib
+import numpy as np
+import pandas as pd
+
+
+CHROMOSOMES = [str(c) for c in range(1, 23)] + ['X', 'Y', 'MT']
+CHROMOSOME_ALIASES = {'M': 'MT'}
+BASES = 'ACGT'
+
+# key layout for SNVs with single base REF and ALT: chromosome code | 32 bit position | 2 bit REF | 2 bit ALT
+# keys use 62 bits and hashed keys are in [-2**62, -1], so the difference of any two keys fits in int64
+KEY_BITS = 62
+POS_BITS = 32
+CHROMOSOME_BITS = KEY_BITS - POS_BITS - 4
+
+
+def chromosome_code(chrom):
+    """Code of a chromosome, the same in every sample and process.
+
+    Args:
+        chrom: chromosome name, with or without 'chr' prefix
+
+    Returns:
+        code from 1 for the human chromosomes, a crc32 based code for other contigs
+
+    """
+    name = str(chrom)
+    if name.lower().startswith('chr'):
+        name = name[3:]
+    name = CHROMOSOME_ALIASES.get(name, name)
+
+    if name in CHROMOSOMES:
+        return CHROMOSOMES.index(name) + 1
+    return 32 + zlib.crc32(name.encode()) % ((1 << CHROMOSOME_BITS) - 32)
+
+
+def map_values(values, function, missing):
+    """Apply function once per distinct value.
+
+    Args:
+        values: pandas Series
+        function: function of one value
+        missing: result for missing values
+
+    Returns:
+        numpy array
+
+    """
+    codes, uniques = pd.factorize(values)
+    mapped = np.array([function(value) for value in uniques] + [missing], dtype=np.int64)
+    return mapped[codes]
+
+
+def base_code(base):
+    """2 bit code of a single base REF or ALT, -1 for anything else."""
+    return BASES.find(base) if isinstance(base, str) and len(base) == 1 else -1
+
+
+def hash_key(chromosome, pos, ref, alt):
+    """Negative key hashed from a variant that does not fit the packed layout."""
+    digest = hashlib.blake2b(':'.join([str(chromosome), str(pos), str(ref), str(alt)]).encode(), digest_size=8).digest()
+    return -(int.from_bytes(digest, 'little') & ((1 << KEY_BITS) - 1)) - 1
+
+
+def encode_variants(chrom, pos, ref, alt):
+    """Encode variants as 64-bit integer keys.
+
+    SNVs are packed from chromosome code, position and 2 bit REF and ALT codes.
+    Other variants, like indels, get a negative key hashed from their fields.
+
+    Args:
+        chrom: pandas Series of chromosomes
+        pos: pandas Series of positions
+        ref: pandas Series of REF alleles
+        alt: pandas Series of ALT alleles
+
+    Returns:
+        numpy int64 array of keys
+
+    """
+    chromosome = map_values(chrom, chromosome_code, 0)
+    position = pd.to_numeric(pos).to_numpy(dtype=np.int64)
+    ref_code = map_values(ref, base_code, -1)
+    alt_code = map_values(alt, base_code, -1)
+
+    keys = (chromosome << (POS_BITS + 4)) | (position << 4) | (ref_code << 2) | alt_code
+
+    unpacked = np.flatnonzero((ref_code < 0) | (alt_code < 0) | (position < 0) | (position >= 1 << POS_BITS))
+    if len(unpacked):
+        fields = zip(chromosome[unpacked], position[unpacked], np.asarray(ref)[unpacked], np.asarray(alt)[unpacked])
+        keys[unpacked] = [hash_key(*variant) for variant in fields]
+
+    return keys
+
+
+def normalize_to_maf(pos, ref, alt):
+    """Normalize vcf indels to maf conventions.
+
+    The padding base shared by REF and ALT of an indel is removed and an empty
+    allele becomes '-'. A deletion then starts one base after POS, an
+    insertion keeps POS. Other variants are unchanged.
+
+    Args:
+        pos: pandas Series of vcf positions
+        ref: pandas Series of vcf REF alleles
+        alt: pandas Series of vcf ALT alleles
+
+    Returns:
+        maf Start_Position, Reference_Allele and Tumor_Seq_Allele2 as pandas Series
+
+    """
+    ref = ref.astype(str)
+    alt = alt.astype(str)
+    indel = ((ref.str.len() != alt.str.len()) & (ref.str[:1] == alt.str[:1])).to_numpy()
+    if not indel.any():
+        return pos, ref, alt
+
+    ref_trimmed = ref[indel].str[1:]
+    alt_trimmed = alt[indel].str[1:]
+
+    pos = pos.copy()
+    pos[indel] += (ref_trimmed != '').to_numpy()
+    ref = ref.copy()
+    ref[indel] = ref_trimmed.replace('', '-')
+    alt = alt.copy()
+    alt[indel] = alt_trimmed.replace('', '-')
+
+    return pos, ref, alt
+
+
+def render_variants(chrom, pos, ref, alt):
+    """Render variants as 'CHROM:POS:REF:ALT' strings.
+
+    Args:
+        chrom: pandas Series of chromosomes
+        pos: pandas Series of positions
+        ref: pandas Series of REF alleles
+        alt: pandas Series of ALT alleles
+
+    Returns:
+        pandas Series of strings
+
+    """
+    return chrom.astype(str) + ':' + pos.astype(str) + ':' + ref.astype(str) + ':' + alt.astype(str)
+
+
+def render(frame, names):
+    """Replace the keys in the SNV column of a frame by their names.
+
+    Args:
+        frame: pandas DataFrame with SNV keys
+        names: pandas Series of names indexed by key
+
+    Returns:
+        pandas DataFrame with SNV names
+
+    """
+    return frame.assign(SNV=names.reindex(frame['SNV']).to_numpy())